@@ -6,9 +6,12 @@ This is a temporary script file.
 """
 
 import os
+import json
 import subprocess
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
 from datetime import datetime
-from xml.dom.minidom import parse
 
 BINDIR = '/home/fou-fd-oper/software/sarwind/met-sar-vind/sarwind'
 
@@ -25,6 +28,8 @@ MODELDIR = '/lustre/storeB/project/metproduction/products/arome_arctic'
 USER_NBS = ''
 PASSWD_NBS = ''
 
+COLHUB_URL = 'https://colhub.met.no/'
+
 
 class SARData():
 
@@ -116,7 +121,117 @@ class SARData():
 
         self.sar_safe_list = sar_safe_list
 
-    def get_NBS_ColhubData(self):
+    def aoi_polygon(self):
+        """ Return the AOI as a WKT polygon coordinate string.
+        """
+        return '%f %f,%f %f,%f %f,%f %f,%f %f' % (self.LLX, self.LLY,
+                                                  self.LRX, self.LRY,
+                                                  self.URX, self.URY,
+                                                  self.ULX, self.ULY,
+                                                  self.LLX, self.LLY)
+
+    @staticmethod
+    def _parse_feed(stream):
+        """ Parse an OpenSearch (Atom) response incrementally, and yield
+        each entry as a dict with title, link and the named elements
+        (e.g., ingestiondate, beginposition).
+        """
+        for event, elem in ET.iterparse(stream):
+            if elem.tag.rsplit('}', 1)[-1] != 'entry':
+                continue
+            entry = {}
+            for child in elem:
+                tag = child.tag.rsplit('}', 1)[-1]
+                if tag == 'title':
+                    entry['title'] = child.text
+                elif tag == 'link' and 'link' not in entry:
+                    entry['link'] = child.get('href')
+                elif child.get('name') is not None:
+                    entry[child.get('name')] = child.text
+            elem.clear()
+            yield entry
+
+    def _load_cursor(self, cursor_file, key):
+        if cursor_file is None or not os.path.isfile(cursor_file):
+            return None
+        with open(cursor_file) as fid:
+            return json.load(fid).get(key)
+
+    def _save_cursor(self, cursor_file, key, value):
+        cursors = {}
+        if os.path.isfile(cursor_file):
+            with open(cursor_file) as fid:
+                cursors = json.load(fid)
+        cursors[key] = value
+        tmp = cursor_file + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(cursors, fid, indent=2)
+        os.replace(tmp, cursor_file)
+
+    def query_catalogue(self, startDate, stopDate, url=COLHUB_URL, typ='GRD', mode='EW',
+                        rows=100, cursor_file=None):
+        """ Query the catalogue for Sentinel-1 data covering the AOI, and
+        yield each entry (see _parse_feed).
+
+        All result pages are fetched, in order of ingestion time, and
+        each page is parsed while it is read. If cursor_file is given,
+        the latest ingestion time seen for the AOI and time window is
+        stored in it, and later queries only fetch entries ingested
+        since then.
+
+        Parameters
+        -----------
+        startDate : string
+                    Start of the sensing time window (ISO format)
+        stopDate : string
+                    End of the sensing time window (ISO format)
+        url : string
+                    URL of the catalogue (OpenSearch API at url/search)
+        typ : string
+                    Product type
+        mode : string
+                    Acquisition mode
+        rows : int
+                    Number of entries per page
+        cursor_file : string
+                    JSON file with the last seen ingestion time per query
+        """
+        query = '(beginPosition:[%s TO %s] AND endPosition:[%s TO %s]) ' % (
+            startDate, stopDate, startDate, stopDate)
+        query = query + 'AND %s AND %s ' % (typ, mode)
+        query = query + 'AND footprint:"Intersects(POLYGON((%s)))"' % (self.aoi_polygon())
+        key = query
+
+        since = self._load_cursor(cursor_file, key)
+        if since is not None:
+            query = query + ' AND ingestiondate:[%s TO NOW]' % since
+
+        passwords = urllib.request.HTTPPasswordMgrWithDefaultRealm()
+        passwords.add_password(None, url, USER_NBS, PASSWD_NBS)
+        opener = urllib.request.build_opener(urllib.request.HTTPBasicAuthHandler(passwords))
+
+        latest = since
+        start = 0
+        while True:
+            params = urllib.parse.urlencode({
+                'q': query, 'rows': rows, 'start': start, 'orderby': 'ingestiondate asc'})
+            print('%ssearch?%s' % (url, params))
+            n_entries = 0
+            with opener.open('%ssearch?%s' % (url, params)) as response:
+                for entry in self._parse_feed(response):
+                    n_entries += 1
+                    ingestiondate = entry.get('ingestiondate')
+                    if ingestiondate is not None and (latest is None or ingestiondate > latest):
+                        latest = ingestiondate
+                    yield entry
+            if n_entries < rows:
+                break
+            start += rows
+
+        if cursor_file is not None and latest is not None:
+            self._save_cursor(cursor_file, key, latest)
+
+    def get_NBS_ColhubData(self, url=COLHUB_URL, cursor_file=None):
         ##################################################
         # Get todays Sentinel-1 data from NBS covering AOI
         # indir: Directory to store raw data localy
@@ -127,44 +242,20 @@ class SARData():
         startDate = '%04d-%02d-%02dT02:00:00.000Z' % (self.year, self.month, self.day)
         stopDate = '%04d-%02d-%02dT09:30:59.999Z' % (self.year, self.month, self.day)
 
+        if cursor_file is None:
+            cursor_file = '%s/catalogueCursors.json' % (LOGDIR)
+
         ##################################################
         # Query relevant Sentinel-1 data from colhob.met.no
-        # Returns a list of available products to be processed.
+        # Generates a list of available data (only data ingested
+        # since the previous query)
         ##################################################
-        url = 'https://colhub.met.no/'
-        typ = 'GRD'
-        mode = 'EW'
-
-        # timeliness = 'NRT-3h'
-        area = '%f %f,%f %f,%f %f,%f %f,%f %f' % (self.LLX, self.LLY,
-                                                  self.LRX, self.LRY,
-                                                  self.URX, self.URY,
-                                                  self.ULX, self.ULY,
-                                                  self.LLX, self.LLY)
-
-        xmlFile = '%s/qres.xml' % (LOGDIR)
-
-        cmd = 'wget --no-check-certificate --user=%s --password=%s --output-document=%s ' % (
-            USER_NBS, PASSWD_NBS, xmlFile)
-        cmd = cmd + '\'%ssearch?q=(beginPosition:[%s TO %s] AND endPosition:[%s TO %s]) ' % (
-            url, startDate, stopDate, startDate, stopDate)
-        cmd = cmd + 'AND %s AND %s ' % (typ, mode)
-        cmd = cmd + 'AND footprint:"Intersects(POLYGON((%s)))"&rows=100&start=0\' '  % (area)
-        print(cmd)
-        subprocess.call(cmd, shell=True)
-
-        # Pars xmlFile to generate list of available data
-        DOMTree = parse(xmlFile)
-        collection = DOMTree.documentElement
-        entrys = collection.getElementsByTagName("entry")
         proclist_tmp = []
         proclist_val = []
 
-        for node in entrys:
-            fname = '%s/%s.zip' % (
-                RAWDIR, node.getElementsByTagName('title')[0].childNodes[0].nodeValue)
-            fval = node.getElementsByTagName("link")[0].getAttribute('href').replace(
-                '$value', '\\$value')
+        for entry in self.query_catalogue(startDate, stopDate, url=url, cursor_file=cursor_file):
+            fname = '%s/%s.zip' % (RAWDIR, entry['title'])
+            fval = entry['link'].replace('$value', '\\$value')
             if fname.find(datestr) > -1:
                 proclist_tmp.append(fname)
                 proclist_val.append(fval)
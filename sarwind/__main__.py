@@ -0,0 +1,7 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+"""
+from sarwind.cli import main
+
+main()
@@ -0,0 +1,215 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+
+Command line interface for SAR wind processing:
+
+    python -m sarwind process SAR_IMAGE [WIND] -o OUTPUT
+    python -m sarwind batch SAR_IMAGE [SAR_IMAGE ...] [-w WIND] -d OUTPUT_DIR
+    python -m sarwind export PRODUCT OUTPUT
+    python -m sarwind quicklook PRODUCT -o PNG
+    python -m sarwind check PRODUCT
+
+Heavy modules (nansat/GDAL, netCDF4, matplotlib) are only imported by
+the subcommands that need them, so that short invocations (e.g., listing
+pending scenes with batch --pending, or checking a product) start fast.
+Use --timing to report import and startup times.
+"""
+import os
+import sys
+import time
+import argparse
+import importlib
+
+_START = time.perf_counter()
+_import_times = {}
+
+
+def _import(name):
+    """ Import a module by name, and record the import time.
+    """
+    t0 = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_times.setdefault(name, time.perf_counter() - t0)
+    return module
+
+
+def _report_timing(t_command):
+    for name, t in _import_times.items():
+        print('import %s: %.3f s' % (name, t), file=sys.stderr)
+    print('startup: %.3f s' % (t_command - _START), file=sys.stderr)
+    print('total: %.3f s' % (time.perf_counter() - _START), file=sys.stderr)
+
+
+def product_filename(sar_image, output_dir):
+    """ Return the filename of the SAR wind product of a SAR image.
+    """
+    scene = os.path.basename(os.path.normpath(sar_image)).split('.')[0]
+    return os.path.join(output_dir, scene + '_wind.nc')
+
+
+def process(args):
+    if args.windowed:
+        if args.direction_source != 'model':
+            raise SystemExit('Windowed processing only supports model wind directions')
+        WindowedSARWind = _import('sarwind.windowed').WindowedSARWind
+        w = WindowedSARWind(args.sar_image, args.wind, pixelsize=args.pixelsize,
+                            resample_alg=args.resample_alg, block_size=args.block_size,
+                            cache_dir=args.cache_dir)
+    else:
+        SARWind = _import('sarwind.sarwind').SARWind
+        w = SARWind(args.sar_image, args.wind, pixelsize=args.pixelsize,
+                    resample_alg=args.resample_alg, cache_dir=args.cache_dir,
+                    direction_source=args.direction_source)
+    if args.output.endswith('.zarr') and not args.windowed:
+        w.export_zarr(args.output)
+    else:
+        w.export(args.output)
+    print('Exported ' + args.output)
+
+
+def batch(args):
+    pending = [fn for fn in args.sar_images
+               if args.overwrite or not os.path.isfile(product_filename(fn, args.output_dir))]
+    if args.pending:
+        for fn in pending:
+            print(fn)
+        return
+
+    if args.wind is None and args.direction_source == 'model':
+        raise SystemExit('A model wind file (--wind) is needed for model wind directions')
+
+    failed = []
+    if args.windowed:
+        for fn in pending:
+            args.sar_image = fn
+            args.output = product_filename(fn, args.output_dir)
+            try:
+                process(args)
+            except Exception as e:
+                print('Failed to process %s: %s' % (fn, e), file=sys.stderr)
+                failed.append(fn)
+    else:
+        # Overlap reading, calculation and export of consecutive scenes
+        Pipeline = _import('sarwind.pipeline').Pipeline
+        pipeline = Pipeline(pixelsize=args.pixelsize, resample_alg=args.resample_alg,
+                            cache_dir=args.cache_dir, queue_size=args.queue_size,
+                            direction_source=args.direction_source)
+        results = pipeline.run(
+            (fn, args.wind, product_filename(fn, args.output_dir)) for fn in pending)
+        failed = [result['sar_image'] for result in results if result['error'] is not None]
+    if failed:
+        raise SystemExit('%d of %d scenes failed' % (len(failed), len(pending)))
+
+
+def export(args):
+    Nansat = _import('nansat.nansat').Nansat
+    n = Nansat(args.product)
+    bands = [n.get_band_number(band) for band in args.bands] if args.bands else None
+    if args.output.endswith('.zarr'):
+        _import('sarwind.zarr_export').export_zarr(n, args.output, bands=bands)
+    else:
+        n.export(args.output, bands=bands)
+        _import('sarwind.sarwind').set_numeric_flag_masks(args.output)
+    print('Exported ' + args.output)
+
+
+def quicklook(args):
+    Nansat = _import('nansat.nansat').Nansat
+    n = Nansat(args.product)
+    n.write_figure(args.output, bands=args.band, clim=[args.vmin, args.vmax], legend=True,
+                   titleString=os.path.basename(args.product))
+    print('Saved ' + args.output)
+
+
+def check(args):
+    netCDF4 = _import('netCDF4')
+    with netCDF4.Dataset(args.product) as ds:
+        missing = [v for v in ['windspeed', 'winddirection'] if v not in ds.variables]
+        if missing:
+            raise SystemExit('%s: missing %s' % (args.product, ', '.join(missing)))
+        windspeed = ds['windspeed'][:]
+        print('%s: %s' % (args.product, ' '.join(
+            '%s=%s' % (k, ds.getncattr(k)) for k in ['time_coverage_start', 'winddir_time']
+            if k in ds.ncattrs())))
+        print('windspeed: shape=%s valid=%d min=%.2f max=%.2f mean=%.2f' % (
+            windspeed.shape, windspeed.count(), windspeed.min(), windspeed.max(),
+            windspeed.mean()))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='sarwind', description='SAR wind processing')
+    parser.add_argument('--timing', action='store_true',
+                        help='Report import and startup times')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    processing = argparse.ArgumentParser(add_help=False)
+    processing.add_argument('-p', '--pixelsize', type=float, default=500,
+                            help='Grid pixel size in metres (0 for full resolution)')
+    processing.add_argument('-r', '--resample-alg', type=int, default=1,
+                            help='Resampling algorithm for reprojecting the wind field')
+    processing.add_argument('--windowed', action='store_true',
+                            help='Process block by block (see sarwind.windowed)')
+    processing.add_argument('--block-size', type=int, default=512,
+                            help='Block size in pixels for windowed processing')
+    processing.add_argument('--cache-dir', default=None,
+                            help='Directory for caching geolocation and look geometry')
+    processing.add_argument('--direction-source', choices=['model', 'sar'], default='model',
+                            help='Source of wind directions (model wind or SAR wind streaks, '
+                                 'which requires a pixel size of at most 300 m)')
+
+    p = subparsers.add_parser('process', parents=[processing],
+                              help='Calculate wind from a SAR image')
+    p.add_argument('sar_image', help='SAR image filename')
+    p.add_argument('wind', nargs='?', default=None,
+                   help='Model wind filename (optional with --direction-source sar)')
+    p.add_argument('-o', '--output', required=True,
+                   help='Output filename (a Zarr store if it ends with .zarr)')
+    p.set_defaults(func=process)
+
+    p = subparsers.add_parser('batch', parents=[processing],
+                              help='Calculate wind from several SAR images')
+    p.add_argument('sar_images', nargs='+', help='SAR image filenames')
+    p.add_argument('-w', '--wind', default=None,
+                   help='Model wind filename (optional with --direction-source sar)')
+    p.add_argument('-d', '--output-dir', default='.', help='Output directory')
+    p.add_argument('--pending', action='store_true',
+                   help='Only list the SAR images without a wind product')
+    p.add_argument('--overwrite', action='store_true', help='Reprocess existing products')
+    p.add_argument('--queue-size', type=int, default=1,
+                   help='Number of scenes prefetched ahead of the calculation')
+    p.set_defaults(func=batch)
+
+    p = subparsers.add_parser('export', help='Export bands of a SAR wind product')
+    p.add_argument('product', help='SAR wind product filename')
+    p.add_argument('output', help='Output filename (a Zarr store if it ends with .zarr)')
+    p.add_argument('-b', '--bands', nargs='+', default=None, help='Names of bands to export')
+    p.set_defaults(func=export)
+
+    p = subparsers.add_parser('quicklook', help='Make a figure of a SAR wind product')
+    p.add_argument('product', help='SAR wind product filename')
+    p.add_argument('-o', '--output', required=True, help='Output figure filename')
+    p.add_argument('-b', '--band', default='windspeed', help='Band to plot')
+    p.add_argument('--vmin', type=float, default=0, help='Lower limit of the colour scale')
+    p.add_argument('--vmax', type=float, default=20, help='Upper limit of the colour scale')
+    p.set_defaults(func=quicklook)
+
+    p = subparsers.add_parser('check', help='Print a summary of a SAR wind product')
+    p.add_argument('product', help='SAR wind product filename')
+    p.set_defaults(func=check)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    t_command = time.perf_counter()
+    try:
+        args.func(args)
+    finally:
+        if args.timing:
+            _report_timing(t_command)
+
+
+if __name__ == '__main__':
+    main()
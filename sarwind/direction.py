@@ -0,0 +1,192 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+
+Wind direction from the orientation of wind streaks in SAR images.
+
+Wind streaks (e.g., from boundary layer rolls) are approximately aligned
+with the wind. Their local orientation is estimated with the local
+gradient (structure tensor) method: the dominant orientation of the
+sigma0 gradients in a moving window is perpendicular to the streaks.
+This leaves a 180 degree ambiguity, which is resolved with a coarse
+prior wind direction (e.g., from a model) when one is available.
+
+Where the streaks are not coherent (e.g., at low wind speed or in
+isotropic areas), the orientation is noise. The prior direction is used
+there instead.
+
+Streaks have wavelengths of a few km, so the SAR image should have a
+pixel size of at most MAX_PIXELSIZE metres.
+"""
+import warnings
+
+import numpy as np
+
+from nansat.utils import initial_bearing
+
+from sarwind.qc import box_sum
+from sarwind.tiling import iter_windows
+from sarwind.tiling import expand_window
+
+# Maximum pixel size [m] for resolving wind streaks
+MAX_PIXELSIZE = 300
+
+# Minimum streak coherence for using the streak orientation. With the
+# default window size, more than 99% of the pixels of a noise image have
+# lower coherence.
+MIN_COHERENCE = 0.3
+
+
+def grid_azimuths(lon, lat):
+    """ Return the bearings [deg] of the image "up" (decreasing row) and
+    "right" (increasing column) directions in each pixel.
+    """
+    up = initial_bearing(lon[1:, :], lat[1:, :], lon[:-1, :], lat[:-1, :])
+    up = np.vstack((up, up[-1:, :]))
+    right = initial_bearing(lon[:, :-1], lat[:, :-1], lon[:, 1:], lat[:, 1:])
+    right = np.hstack((right, right[:, -1:]))
+    return up, right
+
+
+def streak_orientation(sigma0, window_size=15):
+    """ Estimate the local orientation of wind streaks.
+
+    Parameters
+    -----------
+    sigma0 : numpy.array
+                2D array with sigma0 (linear)
+    window_size : int
+                Size in pixels of the moving window (odd)
+
+    Returns
+    --------
+    dx, dy : numpy.array
+                Unit vectors along the streaks, in image coordinates
+                (columns to the right, rows downwards)
+    coherence : numpy.array
+                Degree of alignment of the gradients in the window (0:
+                isotropic, 1: perfectly aligned streaks)
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        img = 10*np.log10(sigma0)
+    finite = np.isfinite(img)
+    img = np.where(finite, img - (img[finite].mean() if np.any(finite) else 0.), 0.)
+    gy, gx = np.gradient(img)
+    # Gradients next to invalid pixels are not used
+    usable = finite & (box_sum(~finite, 3) == 0)
+    gx[~usable] = 0.
+    gy[~usable] = 0.
+
+    jxx = box_sum(gx*gx, window_size)
+    jyy = box_sum(gy*gy, window_size)
+    jxy = box_sum(gx*gy, window_size)
+
+    # Orientation of the dominant gradient; the streaks are perpendicular to it
+    theta = 0.5*np.arctan2(2*jxy, jxx - jyy) + np.pi/2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        coherence = np.sqrt(np.square(jxx - jyy) + 4*np.square(jxy))/(jxx + jyy)
+    coherence[~finite] = np.nan
+    dx = np.cos(theta)
+    dy = np.sin(theta)
+    dx[~finite] = np.nan
+    dy[~finite] = np.nan
+    return dx, dy, coherence
+
+
+def image_to_bearing(dx, dy, up, right):
+    """ Convert vectors (dx, dy) in image coordinates to geographic
+    bearings [deg], given the bearings of the image up and right
+    directions (see grid_azimuths). Mirrored images (right being
+    counterclockwise from up) are handled.
+    """
+    # Angle clockwise from "up" in the image
+    alpha = np.degrees(np.arctan2(dx, -dy))
+    handedness = np.sign(np.sin(np.radians(right - up)))
+    return np.mod(up + handedness*alpha, 360.)
+
+
+def resolve_ambiguity(orientation, prior=None):
+    """ Resolve the 180 degree ambiguity of streak orientations [deg],
+    by choosing the direction closest to the prior wind direction [deg]
+    (array or scalar). Where the orientation is NaN (e.g., incoherent
+    streaks), the prior is returned. Without a prior, directions in
+    [0, 180) are returned.
+    """
+    orientation = np.mod(orientation, 180.)
+    if prior is None:
+        warnings.warn('No prior wind direction - the 180 degree ambiguity is not resolved')
+        return orientation
+    prior = np.broadcast_to(prior, np.shape(orientation))
+    with np.errstate(invalid='ignore'):
+        flip = np.cos(np.radians(prior - orientation)) < 0
+    direction = np.mod(orientation + 180.*flip, 360.)
+    return np.where(np.isnan(orientation), prior, direction)
+
+
+def streak_bearings(sigma0, lon, lat, window_size=15, block_size=1024,
+                    min_coherence=MIN_COHERENCE):
+    """ Estimate the orientation of wind streaks in sigma0 as
+    geographic bearings in [0, 180) degrees.
+
+    The calculation is done block by block (with a halo for the moving
+    window), to limit memory use for large images.
+
+    Parameters
+    -----------
+    sigma0 : numpy.array
+                2D array with sigma0 (linear). Invalid pixels (e.g.,
+                land and ice) should be NaN.
+    lon, lat : numpy.array
+                2D arrays with longitude and latitude [deg]
+    window_size : int
+                Size in pixels of the moving window (odd)
+    block_size : int
+                Size in pixels of the blocks
+    min_coherence : float
+                Minimum streak coherence. The orientation is NaN where
+                the coherence is lower.
+
+    Returns
+    --------
+    orientation : numpy.array
+                Streak orientation [deg]
+    coherence : numpy.array
+                Streak coherence (see streak_orientation)
+    """
+    y_size, x_size = np.shape(sigma0)
+    orientation = np.full((y_size, x_size), np.nan)
+    coherence = np.full((y_size, x_size), np.nan)
+    halo = window_size//2 + 1
+    for window in iter_windows(x_size, y_size, block_size):
+        (x0, y0, nx, ny), crop = expand_window(window, halo, x_size, y_size)
+        x_off, y_off, w_x_size, w_y_size = window
+        dst = (slice(y_off, y_off + w_y_size), slice(x_off, x_off + w_x_size))
+        dx, dy, coh = streak_orientation(sigma0[y0:y0 + ny, x0:x0 + nx], window_size)
+        up, right = grid_azimuths(lon[y0:y0 + ny, x0:x0 + nx], lat[y0:y0 + ny, x0:x0 + nx])
+        orientation[dst] = np.mod(image_to_bearing(dx, dy, up, right)[crop], 180.)
+        coherence[dst] = coh[crop]
+
+    with np.errstate(invalid='ignore'):
+        orientation[~(coherence >= min_coherence)] = np.nan
+    return orientation, coherence
+
+
+def sar_wind_direction(sigma0, lon, lat, prior=None, window_size=15, block_size=1024,
+                       min_coherence=MIN_COHERENCE):
+    """ Estimate wind direction (meteorological convention, i.e., the
+    direction the wind is coming from) from wind streaks in sigma0 (see
+    streak_bearings). The 180 degree ambiguity is resolved with the
+    prior wind direction [deg], which is also used where the streak
+    coherence is below min_coherence (see resolve_ambiguity).
+
+    Returns
+    --------
+    direction : numpy.array
+                Wind direction [deg]
+    coherence : numpy.array
+                Streak coherence (see streak_orientation)
+    """
+    orientation, coherence = streak_bearings(
+        sigma0, lon, lat, window_size=window_size, block_size=block_size,
+        min_coherence=min_coherence)
+    return resolve_ambiguity(orientation, prior), coherence
@@ -0,0 +1,89 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+"""
+import os
+import tempfile
+
+import numpy as np
+
+# Arrays describing the geolocation and look geometry of a SAR scene
+GEOMETRY = ['longitude', 'latitude', 'sensor_azimuth_angle', 'incidence_angle']
+
+
+def scene_id(sar_image):
+    """ Return the scene ID of a SAR image filename, i.e., the basename
+    without extensions (e.g., .SAFE, .zip, .SAFE.nc or .NBS.nc).
+    """
+    return os.path.basename(os.path.normpath(sar_image)).split('.')[0]
+
+
+def scene_format(sar_image):
+    """ Return the input format of a SAR image filename, i.e., its
+    extensions (e.g., SAFE, zip, SAFE.nc or NBS.nc).
+    """
+    parts = os.path.basename(os.path.normpath(sar_image)).split('.', 1)
+    return parts[1] if len(parts) > 1 else ''
+
+
+class SceneCache(object):
+    """
+    A cache of arrays derived from a SAR scene at a given pixel size,
+    stored as .npy sidecar files which are loaded memory-mapped
+    (zero-copy) on later use. Different input formats of the same scene
+    (e.g., SAFE and NBS NetCDF) are cached separately, since their grids
+    and calibration may differ. Cached arrays older than the SAR image
+    (e.g., if it has been downloaded or reprocessed again) are not used.
+
+    Parameters
+    -----------
+    cache_dir : string
+                Directory of the cache
+    sar_image : string
+                The SAR image filename
+    pixelsize : float or int
+                Grid pixel size in metres of the (resized) SAR image
+    """
+
+    def __init__(self, cache_dir, sar_image, pixelsize):
+        key = [scene_id(sar_image), scene_format(sar_image), '%gm' % pixelsize]
+        self.path = os.path.join(cache_dir, '_'.join(k for k in key if k))
+        self.source_mtime = None
+        if os.path.exists(sar_image):
+            self.source_mtime = os.path.getmtime(sar_image)
+
+    def filename(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def has(self, *names):
+        """ Check if all the arrays given by names are cached, and not
+        older than the SAR image.
+        """
+        for name in names:
+            filename = self.filename(name)
+            if not os.path.isfile(filename):
+                return False
+            if self.source_mtime is not None and os.path.getmtime(filename) < self.source_mtime:
+                return False
+        return True
+
+    def load(self, name):
+        """ Return a read-only memory map of a cached array.
+        """
+        return np.load(self.filename(name), mmap_mode='r')
+
+    def save(self, name, array, dtype=np.float32):
+        """ Store an array in the cache. The file is written to a
+        temporary file and renamed, so that concurrent processes never
+        see incomplete arrays.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.npy', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as fid:
+                np.save(fid, np.asarray(array, dtype=dtype))
+            os.replace(tmp, self.filename(name))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return self.load(name)
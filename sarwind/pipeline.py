@@ -0,0 +1,143 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+"""
+import sys
+import queue
+import threading
+import traceback
+
+from datetime import datetime
+
+from sarwind.sarwind import SARWind
+
+# Marks the end of a queue
+_DONE = object()
+
+
+class Pipeline(object):
+    """
+    A pipeline for calculating wind from many SAR images, which overlaps
+    reading, calculation and export of consecutive scenes.
+
+    The pipeline has three stages, connected by bounded queues:
+        load    : open and resize the SAR image, read and reproject the
+                  model wind, read the SAR input arrays and the
+                  watermask (SARWind.load_inputs)
+        process : SAR wind directions (if used), CMOD inversion and QC
+                  (SARWind.process)
+        export  : write the product to file
+    While scene N is processed, scene N+1 is loaded and scene N-1 is
+    exported, each in its own thread.
+
+    Parameters
+    -----------
+    pixelsize : float or int
+                Grid pixel size in metres (0 for full resolution)
+    resample_alg : int
+                Resampling algorithm used for reprojecting wind field
+                to SAR image (see SARWind)
+    cache_dir : string
+                Directory for caching geolocation and look geometry
+    queue_size : int
+                Maximum number of scenes waiting between two stages. This
+                limits the number of scenes held in memory.
+    direction_source : string
+                Source of wind directions, 'model' or 'sar' (see SARWind)
+
+    Example of use:
+                jobs = [(sar_image, wind, 'sarwind.nc'), ...]
+                results = Pipeline(pixelsize=500).run(jobs)
+    """
+
+    def __init__(self, pixelsize=500, resample_alg=1, cache_dir=None, queue_size=1,
+                 direction_source='model'):
+        self.pixelsize = pixelsize
+        self.resample_alg = resample_alg
+        self.cache_dir = cache_dir
+        self.queue_size = queue_size
+        self.direction_source = direction_source
+
+    def load(self, sar_image, wind):
+        """ Open the SAR image and the model wind, and read the inputs
+        of the wind calculation, including the valid pixels.
+        """
+        w = SARWind(sar_image, wind, pixelsize=self.pixelsize, resample_alg=self.resample_alg,
+                    cache_dir=self.cache_dir, process=False,
+                    direction_source=self.direction_source)
+        w.load_inputs()
+        return w
+
+    def process(self, w):
+        w.process()
+        return w
+
+    def export(self, w, output):
+        if output.endswith('.zarr'):
+            w.export_zarr(output)
+        else:
+            w.export(output)
+
+    def _stage(self, func, inq, outq, results):
+        """ Apply func to the items of inq and put the output in outq.
+        Failed jobs are recorded in results and not passed on.
+        """
+        while True:
+            item = inq.get()
+            if item is _DONE:
+                break
+            job, w = item
+            try:
+                w = func(job, w)
+            except Exception as e:
+                traceback.print_exc()
+                print('Failed to process %s: %s' % (job['sar_image'], e), file=sys.stderr)
+                job['error'] = e
+                results.append(job)
+                continue
+            if outq is None:
+                results.append(job)
+            else:
+                outq.put((job, w))
+        if outq is not None:
+            outq.put(_DONE)
+
+    def run(self, jobs):
+        """ Calculate wind for all jobs.
+
+        Parameters
+        -----------
+        jobs : iterable
+                    Tuples of (sar_image, wind, output) filenames
+
+        Returns
+        --------
+        results : list
+                    A dict with sar_image, wind, output and error (None
+                    if successful) for each job, in order of completion
+        """
+        startTime = datetime.now()
+        jobq = queue.Queue()
+        loadq = queue.Queue(maxsize=self.queue_size)
+        exportq = queue.Queue(maxsize=self.queue_size)
+        results = []
+
+        for sar_image, wind, output in jobs:
+            jobq.put(({'sar_image': sar_image, 'wind': wind, 'output': output, 'error': None},
+                      None))
+        jobq.put(_DONE)
+
+        threads = [
+            threading.Thread(target=self._stage, args=(
+                lambda job, w: self.load(job['sar_image'], job['wind']), jobq, loadq, results)),
+            threading.Thread(target=self._stage, args=(
+                lambda job, w: self.export(w, job['output']), exportq, None, results)),
+        ]
+        for thread in threads:
+            thread.start()
+        self._stage(lambda job, w: self.process(w), loadq, exportq, results)
+        for thread in threads:
+            thread.join()
+
+        print('Processed %d scenes in %s' % (len(results), str(datetime.now() - startTime)))
+        return results
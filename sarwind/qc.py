@@ -0,0 +1,142 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+"""
+import numpy as np
+
+from sarwind.cmod5n import cmod5n_forward
+
+# QC bit flags
+FLAG_INVALID = 1
+FLAG_MODEL_DIFFERENCE = 2
+FLAG_LOCAL_VARIANCE = 4
+FLAG_INVERSION_RESIDUAL = 8
+
+FLAG_MEANINGS = {
+    FLAG_INVALID: 'invalid_pixel',
+    FLAG_MODEL_DIFFERENCE: 'large_difference_from_model_wind_speed',
+    FLAG_LOCAL_VARIANCE: 'large_local_wind_speed_variance',
+    FLAG_INVERSION_RESIDUAL: 'large_cmod_inversion_residual',
+}
+
+
+def qc_band_parameters():
+    """ Return the band metadata of the QC flag band (CF flag
+    attributes).
+    """
+    return {
+        'name': 'qc_flags',
+        'long_name': 'SAR wind quality control flags',
+        'flag_masks': ' '.join(str(f) for f in FLAG_MEANINGS),
+        'flag_meanings': ' '.join(FLAG_MEANINGS.values()),
+    }
+
+
+def flag_masks(dtype=np.uint8):
+    """ Return the QC flag masks as a numeric array, as required for
+    the CF flag_masks attribute of the QC flag variable.
+    """
+    return np.array(list(FLAG_MEANINGS), dtype=dtype)
+
+
+def box_sum(array, size):
+    """ Sum of array over a moving size times size window (size must be
+    odd), calculated with a summed-area table. The array is zero padded
+    at the edges, so the output has the same shape as the input.
+    """
+    if size < 1 or size % 2 == 0:
+        raise ValueError('size must be a positive odd integer')
+    r = size // 2
+    # Extra leading row and column of zeros make the table inclusive
+    sat = np.pad(np.asarray(array, dtype=float), ((r + 1, r), (r + 1, r)))
+    sat = sat.cumsum(axis=0).cumsum(axis=1)
+    return sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] + sat[:-size, :-size]
+
+
+def local_variance(array, size=5, min_count=None):
+    """ Variance of array over a moving size times size window, ignoring
+    NaNs. Where fewer than min_count (default half the window) pixels
+    are finite, the variance is NaN.
+    """
+    finite = np.isfinite(array)
+    data = np.where(finite, array, 0.)
+    count = box_sum(finite, size)
+    # Remove the mean before summing to limit round-off errors
+    offset = data[finite].mean() if np.any(finite) else 0.
+    data = np.where(finite, data - offset, 0.)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = box_sum(data, size)/count
+        variance = box_sum(np.square(data), size)/count - np.square(mean)
+    if min_count is None:
+        min_count = size*size/2.
+    variance[count < min_count] = np.nan
+    return np.maximum(variance, 0.)
+
+
+def inversion_residual(windspeed, s0vv, look_relative_wind_direction, inc):
+    """ Return the absolute difference [dB] between the observed sigma0
+    and the sigma0 simulated with CMOD5.N from the retrieved wind.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        s0_calc = cmod5n_forward(np.nan_to_num(windspeed), look_relative_wind_direction, inc)
+        return np.abs(10*np.log10(s0_calc) - 10*np.log10(s0vv))
+
+
+def qc_flags(windspeed, model_windspeed, s0vv, look_dir, winddir, inc, valid=None,
+             max_model_difference=5., max_local_std=3., max_residual=1., window_size=5):
+    """ Calculate QC bit flags of SAR wind.
+
+    Parameters
+    -----------
+    windspeed : numpy.array
+                SAR wind speed [m/s]
+    model_windspeed : numpy.array or None
+                Model wind speed [m/s]
+    s0vv : numpy.array
+                VV polarized sigma0 (linear)
+    look_dir : numpy.array
+                Sensor azimuth angle [deg]
+    winddir : numpy.array
+                Wind direction [deg]
+    inc : numpy.array
+                Incidence angle [deg]
+    valid : numpy.array
+                Valid pixels (equal to 1), e.g., from the watermask
+    max_model_difference : float
+                Maximum absolute difference [m/s] between SAR and model wind speed
+    max_local_std : float
+                Maximum standard deviation [m/s] of SAR wind speed in the moving window
+    max_residual : float
+                Maximum CMOD5.N inversion residual [dB]
+    window_size : int
+                Size in pixels of the moving window (odd)
+
+    Returns
+    --------
+    flags : numpy.array
+                Sum of the FLAG_* values that apply to each pixel (uint8)
+    """
+    flags = np.zeros(np.shape(windspeed), dtype=np.uint8)
+
+    invalid = ~np.isfinite(windspeed)
+    if valid is not None:
+        invalid |= valid != 1
+    flags[invalid] |= FLAG_INVALID
+
+    with np.errstate(invalid='ignore'):
+        if model_windspeed is not None:
+            flags[np.abs(windspeed - model_windspeed) > max_model_difference] |= \
+                FLAG_MODEL_DIFFERENCE
+
+        std = np.sqrt(local_variance(np.where(invalid, np.nan, windspeed), window_size))
+        flags[std > max_local_std] |= FLAG_LOCAL_VARIANCE
+
+        # The residual is only evaluated for valid wind speeds
+        ok = ~invalid
+        look_relative_wind_direction = np.mod(winddir[ok] - look_dir[ok], 360.)
+        residual = np.full(np.shape(windspeed), np.nan)
+        residual[ok] = inversion_residual(
+            windspeed[ok], s0vv[ok], look_relative_wind_direction, inc[ok])
+        flags[residual > max_residual] |= FLAG_INVERSION_RESIDUAL
+
+    return flags
@@ -11,15 +11,187 @@ from dateutil.parser import parse
 import numpy as np
 
 from nansat.nansat import Nansat
+from nansat.utils import initial_bearing
 
 from sarwind.cmod5n import cmod5n_inverse
+from sarwind.direction import MAX_PIXELSIZE
+from sarwind.direction import MIN_COHERENCE
+from sarwind.direction import streak_bearings
+from sarwind.direction import resolve_ambiguity
+from sarwind.geocache import GEOMETRY
+from sarwind.geocache import SceneCache
+from sarwind.qc import qc_flags
+from sarwind.qc import qc_band_parameters
 
 
 class TimeDiffError(Exception):
     pass
 
 
-class SARWind(Nansat, object):
+def polarization_ratio(inc):
+    """ Return the VV/HH polarization ratio at incidence angle inc [deg].
+
+    PR from Lin Ren, Jingsong Yang, Alexis Mouche, et al. (2017) [remote sensing]
+    """
+    return np.square(1.+2.*np.square(np.tan(inc*np.pi/180.))) / \
+        np.square(1.+1.3*np.square(np.tan(inc*np.pi/180.)))
+
+
+def eastward_northward_wind(x_wind, y_wind, az):
+    """ Rotate grid wind components to east-/northward components,
+    given the azimuth [rad] of the grid y-axis.
+    """
+    uu = y_wind*np.sin(az) + x_wind*np.cos(az)
+    vv = y_wind*np.cos(az) - x_wind*np.sin(az)
+    return uu, vv
+
+
+def azimuth_y(lon, lat):
+    """ Return the azimuth [deg] of the grid y-axis, given longitude
+    and latitude grids (same as Nansat.azimuth_y).
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    az = initial_bearing(lon[1:, :], lat[1:, :], lon[:-1, :], lat[:-1, :])
+    # Repeat the last row to match the size of the grids
+    return np.vstack((az, az[-1:, :]))
+
+
+def wind_speed_and_direction(uu, vv):
+    """ Return wind speed and direction from east-/northward wind
+    components. 0 degrees meaning wind from North, 90 degrees meaning
+    wind from East.
+    """
+    wind_dir = np.degrees(np.arctan2(-uu, -vv))
+    wind_speed = np.sqrt(np.power(uu, 2) + np.power(vv, 2))
+    return wind_speed, wind_dir
+
+
+def invert_wind(s0vv, look_dir, winddir, inc):
+    """ Calculate wind speed with CMOD5.N from VV polarized sigma0,
+    sensor azimuth angle, wind direction and incidence angle.
+    """
+    look_dir = np.array(look_dir, dtype=float)
+    look_dir[np.isnan(winddir)] = np.nan
+    look_relative_wind_direction = np.mod(winddir - look_dir, 360.)
+    windspeed = cmod5n_inverse(s0vv, look_relative_wind_direction, inc)
+
+    windspeed[np.where(np.isnan(windspeed))] = np.nan
+    windspeed[np.where(np.isinf(windspeed))] = np.nan
+    return windspeed
+
+
+def wind_components(windspeed, winddir):
+    """ Return eastward and northward wind from wind speed and
+    direction (meteorological convention).
+    """
+    u = -windspeed*np.sin((180.0 - winddir)*np.pi/180.0)
+    v = windspeed*np.cos((180.0 - winddir)*np.pi/180.0)
+    return u, v
+
+
+def set_numeric_flag_masks(filename):
+    """ Convert flag_masks attributes of a NetCDF file from strings
+    (as written from Nansat band metadata) to numeric arrays of the
+    variable type, as required by CF.
+    """
+    import netCDF4
+    with netCDF4.Dataset(filename, 'r+') as ds:
+        for var in ds.variables.values():
+            if isinstance(getattr(var, 'flag_masks', None), str):
+                var.setncattr('flag_masks', np.array(var.flag_masks.split(), dtype=var.dtype))
+
+
+class SARImageMixin(object):
+    """
+    Methods for reading a SAR image and a model wind field, shared by
+    SARWind and the windowed processing (sarwind.windowed). The class
+    must be combined with Nansat.
+    """
+
+    def _set_sigma0_band_number(self):
+        """ Get HH pol NRCS (since we don't want to use pixel function
+        generated VV pol), or VV pol NRCS if HH is not available.
+        """
+        try:
+            self.sigma0_bandNo = self.get_band_number({
+                'standard_name':
+                    'surface_backwards_scattering_coefficient_of_radar_wave',
+                'polarization': 'HH',
+                'dataType': '6'
+            })
+        except ValueError:
+            self.sigma0_bandNo = self.get_band_number({
+                'standard_name':
+                    'surface_backwards_scattering_coefficient_of_radar_wave',
+                'polarization': 'VV',
+                'dataType': '6'
+            })
+
+    def _use_geometry_cache(self):
+        """ Check if cached geometry exists and matches the current grid.
+        """
+        geocache = getattr(self, 'geocache', None)
+        return geocache is not None and geocache.load('longitude').shape == self.shape()
+
+    def _open_aux_wind(self, aux_wind_source):
+        """ Open the wind field in aux_wind_source with Nansat, at the
+        time of the SAR image.
+        """
+        import nansat.nansat
+        mnames = [key.replace('mapper_', '') for key in nansat.nansat.nansatMappers]
+        # check if aux_wind_source is like 'ncep_wind_online', i.e. only
+        # mapper name is given. By adding the SAR image time stamp, we
+        # can then get the data online
+        if aux_wind_source in mnames:
+            aux_wind_source = aux_wind_source + \
+                datetime.strftime(self.time_coverage_start, ':%Y%m%d%H%M')
+        return Nansat(
+            aux_wind_source,
+            netcdf_dim={'time': np.datetime64(self.time_coverage_start)},
+            # CF standard names of desired bands
+            bands=[
+                'x_wind_10m',
+                'y_wind_10m',  # or..:
+                'x_wind',
+                'y_wind',  # or..:
+                'eastward_wind',
+                'northward_wind'])
+
+    def _check_time_difference(self, wind_time):
+        """ Check the time difference between the SAR image and the
+        wind field. Warn if it exceeds 3 hours and raise TimeDiffError
+        if it exceeds 12 hours.
+        """
+        timediff = self.time_coverage_start.replace(tzinfo=None) - \
+            parse(wind_time).replace(tzinfo=None)
+
+        hoursDiff = np.abs(timediff.total_seconds()/3600.)
+
+        print('Time difference between SAR image and wind direction: %.2f hours' % hoursDiff)
+        print('SAR image time: ' + str(self.time_coverage_start))
+        print('Wind dir time: ' + str(parse(wind_time)))
+        if hoursDiff > 3:
+            warnings.warn('Time difference exceeds 3 hours!')
+            if hoursDiff > 12:
+                raise TimeDiffError('Time difference is %.f - impossible to '
+                                    'estimate reliable wind field' % hoursDiff)
+
+    def _update_history(self):
+        """ Append the SAR wind processing step to the history metadata.
+        """
+        history = ""
+        if "history" in self.vrt.dataset.GetMetadata_List():
+            history = self.get_metadata("history")
+        self.set_metadata("history", history + "%s: %s(%s, %s)" % (
+            datetime.now(tz=pytz.UTC).isoformat(),
+            "%s.%s" % (type(self).__module__, type(self).__name__),
+            self.get_metadata('wind_filename'),
+            self.get_metadata('sar_filename'))
+        )
+
+
+class SARWind(SARImageMixin, Nansat):
     """
     A class for calculating wind speed from SAR images using CMOD
 
@@ -29,6 +201,7 @@ class SARWind(Nansat, object):
                 The SAR image as a filename
     wind : string
                 Filename of wind field dataset. This must be possible to open with Nansat.
+                May be None if direction_source is 'sar'.
     pixelsize : float or int
                 Grid pixel size in metres (0 for full resolution)
     resample_alg : int
@@ -40,16 +213,47 @@ class SARWind(Nansat, object):
                      2 : Cubic,
                      3 : CubicSpline,
                      4 : Lancoz
+    cache_dir : string
+                Directory for caching geolocation and look geometry,
+                sigma0 and valid pixels of the SAR image (per scene and
+                pixel size). The cached arrays are memory-mapped on later
+                use, so that rerunning with another model wind field only
+                reads and reprojects the model wind before the inversion.
+    process : bool
+                Calculate wind (see SARWind.process). If False, only the
+                SAR image and the model wind are opened, e.g., to read
+                the inputs (see SARWind.load_inputs) in another thread.
+    direction_source : string
+                Source of the wind directions used in the inversion:
+                    'model' : the model wind field (default)
+                    'sar'   : wind streaks in the SAR image (see
+                              sarwind.direction), with the model wind
+                              direction (if given) as prior for resolving
+                              the 180 degree ambiguity. This requires a
+                              pixelsize of at most MAX_PIXELSIZE metres.
     """
 
-    def __init__(self, sar_image, wind, pixelsize=500, resample_alg=1, *args, **kwargs):
+    def __init__(self, sar_image, wind, pixelsize=500, resample_alg=1, cache_dir=None,
+                 process=True, direction_source='model', *args, **kwargs):
 
-        if not isinstance(sar_image, str) or not isinstance(wind, str):
+        if not isinstance(sar_image, str) or not (isinstance(wind, str) or wind is None):
             raise ValueError('Input parameter for SAR and wind direction must be of type string')
 
+        if direction_source not in ['model', 'sar']:
+            raise ValueError("direction_source must be 'model' or 'sar'")
+
+        if wind is None and direction_source == 'model':
+            raise ValueError('A wind field is needed for model wind directions')
+
+        if direction_source == 'sar' and pixelsize > MAX_PIXELSIZE:
+            raise ValueError('Wind streaks are not resolved with %s m pixel size - use a '
+                             'pixelsize of at most %d m with SAR wind directions'
+                             % (str(pixelsize), MAX_PIXELSIZE))
+
         super(SARWind, self).__init__(sar_image, *args, **kwargs)
 
-        self.set_metadata('wind_filename', wind)
+        self.direction_source = direction_source
+        self.set_metadata('wind_filename', wind or '')
         self.set_metadata('sar_filename', sar_image)
 
         # If this is a netcdf file with already calculated windspeed
@@ -57,43 +261,230 @@ class SARWind(Nansat, object):
         if self.has_band('windspeed'):
             raise Exception('Wind speed already calculated')
 
-        # Get HH pol NRCS (since we don't want to use pixel function generated VV pol)
-        try:
-            self.sigma0_bandNo = self.get_band_number({
-                'standard_name':
-                    'surface_backwards_scattering_coefficient_of_radar_wave',
-                'polarization': 'HH',
-                'dataType': '6'
-            })
-        except ValueError:
-            self.sigma0_bandNo = self.get_band_number({
-                'standard_name':
-                    'surface_backwards_scattering_coefficient_of_radar_wave',
-                'polarization': 'VV',
-                'dataType': '6'
-            })
+        self._set_sigma0_band_number()
 
         print('Resizing SAR image to ' + str(pixelsize) + ' m pixel size')
         self.resize(pixelsize=pixelsize)
 
-        if not self.has_band('wind_direction'):
+        self._set_geometry_cache(cache_dir, sar_image, pixelsize)
+
+        if wind is not None and not self.has_band('wind_direction'):
             self.set_aux_wind(wind, resample_alg=resample_alg, **kwargs)
 
+        if process:
+            self.process()
+
+    def process(self):
+        """ Read the SAR inputs and valid pixels (see load_inputs),
+        estimate wind directions from the SAR image if direction_source
+        is 'sar', and calculate wind.
+        """
+        self.load_inputs()
+
+        if self.direction_source == 'sar':
+            self.set_sar_wind_direction()
+
         self._calculate_wind()
 
-        # Set watermask
-        try:
-            valid = self.watermask(tps=True)[1]
-        except OSError as e:
-            warnings.warn(str(e))
-        else:
-            valid[valid == 2] = 0
+    def set_sar_wind_direction(self, window_size=15, min_coherence=MIN_COHERENCE):
+        """ Add wind direction estimated from wind streaks in the SAR
+        image (see sarwind.direction) as the winddirection band, and the
+        streak coherence as a separate band. The streaks are estimated
+        from valid pixels only, so that land, coastline and ice edge
+        gradients are not taken as streaks. If a model wind direction
+        exists, it is used to resolve the 180 degree ambiguity and where
+        the streak coherence is below min_coherence, and kept as the
+        model_winddirection band. Without a model wind direction, the
+        wind direction is NaN where the coherence is too low.
+
+        Parameters
+        -----------
+        window_size : int
+                    Size in pixels of the moving window for estimating
+                    the streak orientation
+        min_coherence : float
+                    Minimum streak coherence for using the streak
+                    orientation
+        """
+        print('Estimating wind direction from SAR wind streaks...')
+        s0vv = np.array(self.load_inputs()['sigma0_vv'], dtype=float)
+        if self.has_band('valid'):
+            s0vv[self['valid'] != 1] = np.nan
+        lon, lat = self.get_geolocation_grids()
+        self._streak_orientation, coherence = streak_bearings(
+            s0vv, lon, lat, window_size=window_size, min_coherence=min_coherence)
+
+        self.add_band(
+            array=coherence,
+            parameters={
+                'name': 'streak_coherence',
+                'long_name': 'Coherence of SAR wind streak orientation'})
+        self._add_sar_wind_direction_band()
+
+    def _add_sar_wind_direction_band(self):
+        """ Add the wind direction from the streak orientation as the
+        winddirection band, with the ambiguity resolved with the model
+        wind direction (if any), which is moved to model_winddirection.
+        """
+        prior = None
+        if self.has_band('winddirection'):
+            prior = self['winddirection']
+            prior_time = self.get_metadata(key='time', band_id='winddirection')
+            self.vrt.delete_bands([self.get_band_number('winddirection')])
             self.add_band(
-                array=valid,
+                array=prior,
                 parameters={
-                    'name': 'valid',
-                    'note': 'All pixels not equal to 1 are invalid',
-                    'long_name': 'Valid pixels (covering open water)'})
+                    'wkv': 'wind_from_direction', 'name': 'model_winddirection',
+                    'time': prior_time})
+
+        if prior is not None:
+            note = 'Ambiguity resolved with model wind direction, which is also used ' \
+                'where the streaks are not coherent'
+        else:
+            note = '180 degree ambiguity not resolved'
+        self.add_band(
+            array=resolve_ambiguity(self._streak_orientation, prior),
+            parameters={
+                'wkv': 'wind_from_direction', 'name': 'winddirection',
+                'time': self.time_coverage_start,
+                'source': 'SAR wind streaks',
+                'note': note})
+
+    def update_wind(self, wind, resample_alg=1, **kwargs):
+        """ Recalculate wind with a new model wind field (e.g., from a
+        newer model run). The SAR inputs (see load_inputs) and the valid
+        band are reused, so only the model wind is read and reprojected
+        before the inversion. With SAR wind directions, the streak
+        orientation and coherence are also reused, and only the 180
+        degree ambiguity is resolved again with the new model wind.
+
+        Parameters
+        -----------
+        wind : string
+                    Filename of wind field dataset. This must be possible to open with Nansat.
+        resample_alg : int
+                    Resampling algorithm used for reprojecting wind field
+                    to SAR image (see SARWind)
+        """
+        if not isinstance(wind, str):
+            raise ValueError('Input parameter for wind direction must be of type string')
+
+        reuse_streaks = self.direction_source == 'sar' and \
+            getattr(self, '_streak_orientation', None) is not None
+
+        bands = ['windspeed', 'winddirection', 'model_windspeed', 'qc_flags',
+                 'model_winddirection', {'standard_name': 'eastward_wind'},
+                 {'standard_name': 'northward_wind'}]
+        if not reuse_streaks:
+            bands.append('streak_coherence')
+
+        band_nums = []
+        for band in bands:
+            try:
+                band_nums.append(self.get_band_number(band))
+            except ValueError:
+                pass
+        self.vrt.delete_bands(band_nums)
+
+        self.set_metadata('wind_filename', wind)
+        self.set_aux_wind(wind, resample_alg=resample_alg, **kwargs)
+        if reuse_streaks:
+            self._add_sar_wind_direction_band()
+        elif self.direction_source == 'sar':
+            self.set_sar_wind_direction()
+        self._calculate_wind()
+
+    def load_inputs(self):
+        """ Read the SAR input arrays of the wind calculation (VV
+        polarized sigma0, incidence angle and sensor azimuth angle)
+        into memory, and return them as a dict. The valid pixels band
+        is also added from the watermask, unless it exists. The arrays
+        are read only once, and are reused by _calculate_wind. If the
+        geometry cache is used, sigma0 and the valid pixels are also
+        cached for later runs.
+        """
+        if getattr(self, '_inputs', None) is None:
+            look_dir = self._get_geometry('sensor_azimuth_angle')
+            inc = self._get_geometry('incidence_angle')
+
+            if self._use_geometry_cache() and self.geocache.has('sigma0_vv'):
+                s0vv = self.geocache.load('sigma0_vv')
+            else:
+                s0vv = self[self.sigma0_bandNo]
+
+                if self.get_metadata(band_id=self.sigma0_bandNo, key='polarization') == 'HH':
+                    # This is a hack to use another PR model than in the nansat pixelfunctions
+                    s0vv = s0vv*polarization_ratio(inc)
+
+                if self._use_geometry_cache():
+                    s0vv = self.geocache.save('sigma0_vv', s0vv)
+
+            self._inputs = {
+                'sigma0_vv': s0vv,
+                'incidence_angle': inc,
+                'sensor_azimuth_angle': look_dir,
+            }
+
+            if not self.has_band('valid'):
+                self._add_valid_band()
+        return self._inputs
+
+    def _set_geometry_cache(self, cache_dir, sar_image, pixelsize):
+        """ Set the cache of geolocation and look geometry, and fill it
+        if it does not exist yet.
+        """
+        self.geocache = None
+        if cache_dir is None:
+            return
+        geocache = SceneCache(cache_dir, sar_image, pixelsize)
+        if not geocache.has(*GEOMETRY):
+            print('Caching geolocation and look geometry in ' + geocache.path)
+            lon, lat = super(SARWind, self).get_geolocation_grids()
+            geocache.save('longitude', lon)
+            geocache.save('latitude', lat)
+            geocache.save('sensor_azimuth_angle', self._get_geometry('sensor_azimuth_angle'))
+            geocache.save('incidence_angle', self._get_geometry('incidence_angle'))
+        self.geocache = geocache
+
+    def _get_geometry(self, name):
+        """ Return the sensor_azimuth_angle or incidence_angle array,
+        from the cache if available.
+        """
+        if self._use_geometry_cache():
+            return self.geocache.load(name)
+        if name == 'sensor_azimuth_angle':
+            return self[self.get_band_number({'standard_name': 'sensor_azimuth_angle'})]
+        return self[name]
+
+    def get_geolocation_grids(self, stepSize=1, dst_srs=None):
+        """ Get longitude and latitude grids, from the cache if
+        available (see Nansat.get_geolocation_grids).
+        """
+        if stepSize == 1 and dst_srs is None and self._use_geometry_cache():
+            return self.geocache.load('longitude'), self.geocache.load('latitude')
+        return super(SARWind, self).get_geolocation_grids(stepSize=stepSize, dst_srs=dst_srs)
+
+    def _add_valid_band(self):
+        """ Add band with valid pixels (covering open water) from the
+        watermask (or from the cache, if it is used).
+        """
+        if self._use_geometry_cache() and self.geocache.has('valid'):
+            valid = np.array(self.geocache.load('valid'))
+        else:
+            try:
+                valid = self.watermask(tps=True)[1]
+            except OSError as e:
+                warnings.warn(str(e))
+                return
+            valid[valid == 2] = 0
+            if self._use_geometry_cache():
+                self.geocache.save('valid', valid, dtype=np.uint8)
+        self.add_band(
+            array=valid,
+            parameters={
+                'name': 'valid',
+                'note': 'All pixels not equal to 1 are invalid',
+                'long_name': 'Valid pixels (covering open water)'})
 
     def set_aux_wind(self, wind, *args, **kwargs):
         """
@@ -123,25 +514,7 @@ class SARWind(Nansat, object):
         """ Get wind field from a file (aux_wind_source) that can be
         opened with Nansat.
         """
-        import nansat.nansat
-        mnames = [key.replace('mapper_', '') for key in nansat.nansat.nansatMappers]
-        # check if aux_wind_source is like 'ncep_wind_online', i.e. only
-        # mapper name is given. By adding the SAR image time stamp, we
-        # can then get the data online
-        if aux_wind_source in mnames:
-            aux_wind_source = aux_wind_source + \
-                datetime.strftime(self.time_coverage_start, ':%Y%m%d%H%M')
-        aux = Nansat(
-            aux_wind_source,
-            netcdf_dim={'time': np.datetime64(self.time_coverage_start)},
-            # CF standard names of desired bands
-            bands=[
-                'x_wind_10m',
-                'y_wind_10m',  # or..:
-                'x_wind',
-                'y_wind',  # or..:
-                'eastward_wind',
-                'northward_wind'])
+        aux = self._open_aux_wind(aux_wind_source)
         # Set filename of source wind in metadata
         wspeed, wdir, wdir_time = self._get_wind_direction_array(aux, *args, **kwargs)
 
@@ -165,8 +538,13 @@ class SARWind(Nansat, object):
             x_wind_bandNo = aux_wind.get_band_number({'standard_name': 'x_wind'})
             y_wind_bandNo = aux_wind.get_band_number({'standard_name': 'y_wind'})
             mask = aux_wind['swathmask']
-            # Get azimuth of aux_wind y-axis in radians
-            az = aux_wind.azimuth_y()*np.pi/180
+            # Get azimuth of aux_wind y-axis in radians. The wind field is
+            # reprojected onto the SAR image grid, so the cached
+            # geolocation can be used instead of the GCPs.
+            if self._use_geometry_cache():
+                az = azimuth_y(*self.get_geolocation_grids())*np.pi/180
+            else:
+                az = aux_wind.azimuth_y()*np.pi/180
             az[mask == 0] = np.nan
             # Get x direction wind
             x_wind = aux_wind[x_wind_bandNo]
@@ -180,26 +558,13 @@ class SARWind(Nansat, object):
             y_wind[mask == 0] = np.nan
 
             # Get east-/westward wind speeds
-            uu = y_wind*np.sin(az) + x_wind*np.cos(az)
-            vv = y_wind*np.cos(az) - x_wind*np.sin(az)
+            uu, vv = eastward_northward_wind(x_wind, y_wind, az)
             #aux_wind.add_band(array=uu, parameters={'wkv': 'eastward_wind', 'minmax': '-25 25'})
             #aux_wind.add_band(array=vv, parameters={'wkv': 'northward_wind', 'minmax': '-25 25'})
-        
+
         # Check time difference between SAR image and wind direction object
         wind_time = aux_wind.get_metadata('time_coverage_start')
-        timediff = self.time_coverage_start.replace(tzinfo=None) - \
-            parse(wind_time).replace(tzinfo=None)
-
-        hoursDiff = np.abs(timediff.total_seconds()/3600.)
-
-        print('Time difference between SAR image and wind direction: %.2f hours' % hoursDiff)
-        print('SAR image time: ' + str(self.time_coverage_start))
-        print('Wind dir time: ' + str(parse(wind_time)))
-        if hoursDiff > 3:
-            warnings.warn('Time difference exceeds 3 hours!')
-            if hoursDiff > 12:
-                raise TimeDiffError('Time difference is %.f - impossible to '
-                                    'estimate reliable wind field' % hoursDiff)
+        self._check_time_difference(wind_time)
 
         ## Get band numbers of eastward and northward wind
         #eastward_wind_bandNo = aux_wind.get_band_number({'standard_name': 'eastward_wind'})
@@ -214,10 +579,8 @@ class SARWind(Nansat, object):
 
         #if uu is None:
         #    raise Exception('Could not read wind vectors')
-        # 0 degrees meaning wind from North, 90 degrees meaning wind from East
         # Return wind direction, time, wind speed
-        wind_dir = np.degrees(np.arctan2(-uu, -vv))
-        wind_speed = np.sqrt(np.power(uu, 2) + np.power(vv, 2))
+        wind_speed, wind_dir = wind_speed_and_direction(uu, vv)
         return wind_speed, wind_dir, wind_time
 
     def _calculate_wind(self):
@@ -228,34 +591,23 @@ class SARWind(Nansat, object):
         # - add other CMOD versions than CMOD5
         print('Calculating SAR wind with CMOD...')
         startTime = datetime.now()
-        look_dir = self[self.get_band_number({'standard_name': 'sensor_azimuth_angle'})]
-
-        s0vv = self[self.sigma0_bandNo]
-
-        if self.get_metadata(band_id=self.sigma0_bandNo, key='polarization') == 'HH':
-            # This is a hack to use another PR model than in the nansat pixelfunctions
-            inc = self['incidence_angle']
-            # PR from Lin Ren, Jingsong Yang, Alexis Mouche, et al. (2017) [remote sensing]
-            PR = np.square(1.+2.*np.square(np.tan(inc*np.pi/180.))) / \
-                np.square(1.+1.3*np.square(np.tan(inc*np.pi/180.)))
-            s0hh_band_no = self.get_band_number({
-                'standard_name':
-                    'surface_backwards_scattering_coefficient_of_radar_wave',
-                'polarization': 'HH',
-                'dataType': '6'
-            })
-            s0vv = self[s0hh_band_no]*PR
+        inputs = self.load_inputs()
+        look_dir = inputs['sensor_azimuth_angle']
+        s0vv = inputs['sigma0_vv']
+        inc = inputs['incidence_angle']
 
         winddir = self['winddirection']
-        look_dir[np.isnan(winddir)] = np.nan
-        look_relative_wind_direction = np.mod(winddir - look_dir, 360.)
-        windspeed = cmod5n_inverse(s0vv, look_relative_wind_direction,
-                                   self['incidence_angle'])
+        windspeed = invert_wind(s0vv, look_dir, winddir, inc)
+
+        # Flag pixels deviating from the model wind or the CMOD5.N
+        # model, while the input arrays are in memory
+        flags = qc_flags(
+            windspeed,
+            self['model_windspeed'] if self.has_band('model_windspeed') else None,
+            s0vv, look_dir, winddir, inc,
+            valid=self['valid'] if self.has_band('valid') else None)
         print('Calculation time: ' + str(datetime.now() - startTime))
 
-        windspeed[np.where(np.isnan(windspeed))] = np.nan
-        windspeed[np.where(np.isinf(windspeed))] = np.nan
-
         # Add wind speed and direction as bands
         wind_direction_time = self.get_metadata(key='time', band_id='winddirection')
         self.add_band(
@@ -268,40 +620,44 @@ class SARWind(Nansat, object):
             })
 
         # TODO: Replace U and V bands with pixelfunctions
-        u = -windspeed*np.sin((180.0 - self['winddirection'])*np.pi/180.0)
-        v = windspeed*np.cos((180.0 - self['winddirection'])*np.pi/180.0)
+        u, v = wind_components(windspeed, winddir)
         self.add_band(array=u, parameters={
                             'wkv': 'eastward_wind',
                             'time': wind_direction_time,
         })
         self.add_band(array=v, parameters={'wkv': 'northward_wind', 'time': wind_direction_time})
+        self.add_band(array=flags, parameters=qc_band_parameters())
 
         # set winddir_time to global metadata
         self.set_metadata('winddir_time', str(wind_direction_time))
 
         # Update history
-        history = ""
-        if "history" in self.vrt.dataset.GetMetadata_List():
-            history = self.get_metadata("history")
-        self.set_metadata("history", history + "%s: %s(%s, %s)" % (
-            datetime.now(tz=pytz.UTC).isoformat(),
-            "sarwind.sarwind.SARWind",
-            self.get_metadata('wind_filename'),
-            self.get_metadata('sar_filename'))
-        )
+        self._update_history()
 
     def get_bands_to_export(self, bands):
         if not bands:
             bands = [
-                self.get_band_number('valid'),
-                self.get_band_number('winddirection'),
-                self.get_band_number('windspeed'),
-                self.get_band_number('model_windspeed'),
+                self.get_band_number(band)
+                for band in ['valid', 'winddirection', 'windspeed', 'model_windspeed',
+                             'model_winddirection', 'streak_coherence', 'qc_flags']
+                if self.has_band(band)
             ]
         return bands
 
-    def export(self, *args, **kwargs):
+    def export(self, filename, *args, **kwargs):
         bands = kwargs.pop('bands', None)
         # TODO: add name of original file to metadata
 
-        super(SARWind, self).export(bands=self.get_bands_to_export(bands), *args, **kwargs)
+        super(SARWind, self).export(
+            filename, bands=self.get_bands_to_export(bands), *args, **kwargs)
+        if kwargs.get('driver', 'netCDF') == 'netCDF':
+            set_numeric_flag_masks(filename)
+
+    def export_zarr(self, path, bands=None, chunks=512, workers=4):
+        """ Export wind bands, geolocation and metadata to a chunked and
+        compressed Zarr store (requires the zarr package). See
+        sarwind.zarr_export.export_zarr.
+        """
+        from sarwind.zarr_export import export_zarr
+        export_zarr(self, path, bands=self.get_bands_to_export(bands), chunks=chunks,
+                    workers=workers)
@@ -0,0 +1,35 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+
+Tiling of rasters into blocks, for processing large images block by
+block. This module only depends on the standard library.
+"""
+
+
+def iter_windows(x_size, y_size, block_size):
+    """ Yield windows (x_offset, y_offset, x_size, y_size) covering a
+    raster of size x_size times y_size in blocks of at most
+    block_size times block_size pixels, row by row.
+    """
+    if block_size < 1:
+        raise ValueError('block_size must be a positive integer')
+    for y_off in range(0, y_size, block_size):
+        for x_off in range(0, x_size, block_size):
+            yield (x_off, y_off,
+                   min(block_size, x_size - x_off),
+                   min(block_size, y_size - y_off))
+
+
+def expand_window(window, halo, x_size, y_size):
+    """ Expand a window by halo pixels on each side (limited by the
+    raster size x_size times y_size). Returns the expanded window and
+    the slices of the original window within the expanded one.
+    """
+    x_off, y_off, w_x_size, w_y_size = window
+    x0 = max(x_off - halo, 0)
+    y0 = max(y_off - halo, 0)
+    x1 = min(x_off + w_x_size + halo, x_size)
+    y1 = min(y_off + w_y_size + halo, y_size)
+    crop = (slice(y_off - y0, y_off - y0 + w_y_size), slice(x_off - x0, x_off - x0 + w_x_size))
+    return (x0, y0, x1 - x0, y1 - y0), crop
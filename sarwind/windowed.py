@@ -0,0 +1,375 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+"""
+import warnings
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import netCDF4
+
+from nansat.nansat import Nansat
+
+from sarwind.sarwind import SARImageMixin
+from sarwind.sarwind import polarization_ratio
+from sarwind.sarwind import eastward_northward_wind
+from sarwind.sarwind import wind_speed_and_direction
+from sarwind.sarwind import invert_wind
+from sarwind.sarwind import azimuth_y
+from sarwind.qc import qc_flags
+from sarwind.qc import qc_band_parameters
+from sarwind.qc import flag_masks
+from sarwind.geocache import GEOMETRY
+from sarwind.geocache import SceneCache
+from sarwind.tiling import iter_windows
+from sarwind.tiling import expand_window
+
+
+def read_window(n, band_id, window):
+    """ Read a window of a Nansat band as a numpy array, with the
+    same treatment of fill values, infs and swathmask as
+    Nansat.__getitem__.
+    """
+    band = n.get_GDALRasterBand(band_id)
+    band_data = band.ReadAsArray(*window)
+    if band_data is None:
+        raise ValueError('Cannot read window %s from band %s' % (str(window), str(band_id)))
+
+    if band_data.dtype.char not in np.typecodes['AllFloat']:
+        return band_data
+
+    if '_FillValue' in band.GetMetadata():
+        band_data[band_data == float(band.GetMetadata()['_FillValue'])] = np.nan
+    band_data[np.isinf(band_data)] = np.nan
+    if n.has_band('swathmask'):
+        swathmask = n.get_GDALRasterBand('swathmask').ReadAsArray(*window)
+        band_data[swathmask == 0] = np.nan
+
+    return band_data
+
+
+def export_bands(valid=True):
+    """ Return the names and attributes (including data type) of the
+    bands written by the windowed processing.
+    """
+    bands = {
+        'windspeed': {
+            'standard_name': 'wind_speed', 'units': 'm s-1',
+            'long_name': 'SAR wind speed', 'dtype': 'f4'},
+        'winddirection': {
+            'standard_name': 'wind_from_direction', 'units': 'degree',
+            'long_name': 'Model wind direction', 'dtype': 'f4'},
+        'model_windspeed': {
+            'standard_name': 'wind_speed', 'units': 'm s-1',
+            'long_name': 'Model wind speed', 'dtype': 'f4'},
+    }
+    if valid:
+        bands['valid'] = {
+            'note': 'All pixels not equal to 1 are invalid',
+            'long_name': 'Valid pixels (covering open water)', 'dtype': 'u1'}
+    attrs = qc_band_parameters()
+    attrs['flag_masks'] = flag_masks()
+    attrs['dtype'] = 'u1'
+    bands[attrs.pop('name')] = attrs
+    for attrs in bands.values():
+        attrs['coordinates'] = 'longitude latitude'
+    bands['longitude'] = {'standard_name': 'longitude', 'units': 'degree_east', 'dtype': 'f4'}
+    bands['latitude'] = {'standard_name': 'latitude', 'units': 'degree_north', 'dtype': 'f4'}
+    return bands
+
+
+class _NetCDFBlockWriter(object):
+    """ Write blocks of SAR wind bands to a chunked NetCDF-CF file.
+    """
+
+    def __init__(self, filename, shape, block_size, bands, metadata):
+        self.ds = netCDF4.Dataset(filename, 'w')
+        self.ds.createDimension('y', shape[0])
+        self.ds.createDimension('x', shape[1])
+        chunks = (min(block_size, shape[0]), min(block_size, shape[1]))
+        for name, attrs in bands.items():
+            attrs = dict(attrs)
+            dtype = np.dtype(attrs.pop('dtype'))
+            var = self.ds.createVariable(
+                name, dtype, ('y', 'x'), zlib=True, chunksizes=chunks,
+                fill_value=np.nan if dtype.kind == 'f' else None)
+            if 'flag_masks' in attrs:
+                attrs['flag_masks'] = np.array(attrs['flag_masks'], dtype=dtype)
+            var.setncatts(attrs)
+        self.ds.setncatts(metadata)
+
+    def write(self, window, arrays):
+        x_off, y_off, x_size, y_size = window
+        for name, array in arrays.items():
+            if name in self.ds.variables:
+                self.ds[name][y_off:y_off + y_size, x_off:x_off + x_size] = array
+
+    def close(self):
+        self.ds.close()
+
+
+class WindowedSARWind(SARImageMixin, Nansat):
+    """
+    A class for calculating wind speed from SAR images using CMOD, block
+    by block, without holding full scene arrays in memory.
+
+    The SAR image, the reprojected wind field and the watermask are kept
+    as lazy (VRT) datasets. The wind is calculated when exporting, where
+    each block is read, inverted, masked and written to the output file
+    before the next block is processed.
+
+    Parameters
+    -----------
+    sar_image : string
+                The SAR image as a filename
+    wind : string
+                Filename of wind field dataset. This must be possible to open with Nansat.
+    pixelsize : float or int
+                Grid pixel size in metres (0 for full resolution)
+    resample_alg : int
+                Resampling algorithm used for reprojecting wind field
+                to SAR image (see SARWind)
+    block_size : int
+                Size in pixels of the square blocks processed at a time
+    qc_kwargs : dict
+                Keyword arguments to sarwind.qc.qc_flags (thresholds and
+                window_size)
+    cache_dir : string
+                Directory with cached geolocation and look geometry (see
+                SARWind). Windows are read from the cache if it exists.
+
+    Only model wind directions are used.
+
+    Example of use:
+                w = WindowedSARWind(sar_image, wind, pixelsize=0, block_size=1024)
+                w.export('sarwind.nc')
+    """
+
+    def __init__(self, sar_image, wind, pixelsize=500, resample_alg=1, block_size=512,
+                 qc_kwargs=None, cache_dir=None, *args, **kwargs):
+
+        if not isinstance(sar_image, str) or not isinstance(wind, str):
+            raise ValueError('Input parameter for SAR and wind direction must be of type string')
+
+        super(WindowedSARWind, self).__init__(sar_image, *args, **kwargs)
+
+        self.set_metadata('wind_filename', wind)
+        self.set_metadata('sar_filename', sar_image)
+
+        if self.has_band('windspeed'):
+            raise Exception('Wind speed already calculated')
+
+        self._set_sigma0_band_number()
+        self.is_hh = self.get_metadata(
+            band_id=self.sigma0_bandNo, key='polarization') == 'HH'
+
+        print('Resizing SAR image to ' + str(pixelsize) + ' m pixel size')
+        self.resize(pixelsize=pixelsize)
+
+        self.geocache = None
+        if cache_dir is not None:
+            geocache = SceneCache(cache_dir, sar_image, pixelsize)
+            if geocache.has(*GEOMETRY):
+                self.geocache = geocache
+
+        self.block_size = block_size
+        self.qc_kwargs = qc_kwargs or {}
+        # Blocks are read with a halo for the moving window of the QC
+        self.halo = self.qc_kwargs.get('window_size', 5)//2
+
+        # Lazy reprojection of the wind field onto the SAR image
+        self.aux_wind = self._open_aux_wind(wind)
+        self.aux_wind.reproject(self, resample_alg=resample_alg, tps=True)
+        self.wind_direction_time = self.aux_wind.get_metadata('time_coverage_start')
+        self._check_time_difference(self.wind_direction_time)
+        self.x_wind_bandNo = self.aux_wind.get_band_number({'standard_name': 'x_wind'})
+        self.y_wind_bandNo = self.aux_wind.get_band_number({'standard_name': 'y_wind'})
+
+        try:
+            self.mask = self.watermask(tps=True)
+        except OSError as e:
+            warnings.warn(str(e))
+            self.mask = None
+
+    def windows(self):
+        """ Return an iterator over the windows of the SAR image.
+        """
+        y_size, x_size = self.shape()
+        return iter_windows(x_size, y_size, self.block_size)
+
+    def _lonlat_window(self, window):
+        """ Return longitude and latitude of the window, with an extra
+        row below (or above, at the last row of the image) for
+        calculating the azimuth of the y-axis. Also return the row
+        offset of the window within the returned grids.
+        """
+        x_off, y_off, x_size, y_size = window
+        ny = self.shape()[0]
+        start = max(min(y_off, ny - 2), 0)
+        stop = min(y_off + y_size + 1, ny)
+        if self._use_geometry_cache():
+            lon = self.geocache.load('longitude')[start:stop, x_off:x_off + x_size]
+            lat = self.geocache.load('latitude')[start:stop, x_off:x_off + x_size]
+            return np.array(lon, dtype=float), np.array(lat, dtype=float), y_off - start
+        x_grid, y_grid = np.meshgrid(np.arange(x_off, x_off + x_size), np.arange(start, stop))
+        lon, lat = self.transform_points(x_grid.flatten(), y_grid.flatten())
+        return lon.reshape(x_grid.shape), lat.reshape(x_grid.shape), y_off - start
+
+    def _read_geometry_window(self, name, window):
+        """ Read a window of sensor_azimuth_angle or incidence_angle,
+        from the cache if available.
+        """
+        if self._use_geometry_cache():
+            x_off, y_off, x_size, y_size = window
+            return np.array(
+                self.geocache.load(name)[y_off:y_off + y_size, x_off:x_off + x_size], dtype=float)
+        if name == 'sensor_azimuth_angle':
+            name = self.get_band_number({'standard_name': 'sensor_azimuth_angle'})
+        return read_window(self, name, window)
+
+    def read_block(self, window):
+        """ Read the input data needed for the wind calculation in a
+        window of the SAR image, expanded with a halo.
+        """
+        y_size, x_size = self.shape()
+        block = {'window': window}
+        window, block['crop'] = expand_window(window, self.halo, x_size, y_size)
+        y_size = window[3]
+        block['sigma0'] = read_window(self, self.sigma0_bandNo, window)
+        block['incidence_angle'] = self._read_geometry_window('incidence_angle', window)
+        block['sensor_azimuth_angle'] = self._read_geometry_window('sensor_azimuth_angle', window)
+
+        lon, lat, row = self._lonlat_window(window)
+        az = azimuth_y(lon, lat)
+        block['azimuth_y'] = az[row:row + y_size]
+        block['longitude'] = lon[row:row + y_size]
+        block['latitude'] = lat[row:row + y_size]
+
+        block['swathmask'] = read_window(self.aux_wind, 'swathmask', window)
+        block['x_wind'] = read_window(self.aux_wind, self.x_wind_bandNo, window)
+        block['y_wind'] = read_window(self.aux_wind, self.y_wind_bandNo, window)
+
+        if self.mask is not None:
+            block['valid'] = read_window(self.mask, 1, window)
+
+        return block
+
+    def process_block(self, block):
+        """ Calculate wind and QC flags from the input data of a block,
+        and return the output bands (without halo).
+        """
+        inc = block['incidence_angle']
+        s0vv = block['sigma0']
+        if self.is_hh:
+            s0vv = s0vv*polarization_ratio(inc)
+
+        mask = block['swathmask']
+        az = block['azimuth_y']*np.pi/180
+        az[mask == 0] = np.nan
+        x_wind = block['x_wind']
+        x_wind[mask == 0] = np.nan
+        y_wind = block['y_wind']
+        y_wind[mask == 0] = np.nan
+        uu, vv = eastward_northward_wind(x_wind, y_wind, az)
+        model_windspeed, winddir = wind_speed_and_direction(uu, vv)
+
+        look_dir = block['sensor_azimuth_angle']
+        windspeed = invert_wind(s0vv, look_dir, winddir, inc)
+
+        outputs = {
+            'windspeed': windspeed,
+            'winddirection': winddir,
+            'model_windspeed': model_windspeed,
+            'longitude': block['longitude'],
+            'latitude': block['latitude'],
+        }
+        valid = None
+        if 'valid' in block:
+            valid = block['valid']
+            valid[valid == 2] = 0
+            outputs['valid'] = valid
+
+        outputs['qc_flags'] = qc_flags(windspeed, model_windspeed, s0vv, look_dir, winddir, inc,
+                                       valid=valid, **self.qc_kwargs)
+
+        return {name: array[block['crop']] for name, array in outputs.items()}
+
+    def _export_metadata(self):
+        """ Return global metadata for the exported file.
+        """
+        self.set_metadata('winddir_time', str(self.wind_direction_time))
+        self._update_history()
+        metadata = self.get_metadata()
+        return {key: str(val) for key, val in metadata.items()}
+
+    def _writer(self, filename, bands=None, zarr=False):
+        """ Return a NetCDF or Zarr block writer for the output bands
+        (names, default all), with longitude and latitude.
+        """
+        all_bands = export_bands(valid=self.mask is not None)
+        if bands is not None:
+            unknown = set(bands) - set(all_bands)
+            if unknown:
+                raise ValueError('Cannot export bands %s' % ', '.join(sorted(unknown)))
+            bands = {name: attrs for name, attrs in all_bands.items()
+                     if name in bands or name in ['longitude', 'latitude']}
+        else:
+            bands = all_bands
+        if zarr:
+            from sarwind.zarr_export import ZarrBlockWriter
+            return ZarrBlockWriter(filename, self.shape(), self.block_size, bands,
+                                   self._export_metadata())
+        return _NetCDFBlockWriter(filename, self.shape(), self.block_size, bands,
+                                  self._export_metadata())
+
+    def export(self, filename, bands=None, prefetch=True, writer=None):
+        """ Calculate wind block by block and write it to filename.
+
+        Parameters
+        -----------
+        filename : string
+                    Output NetCDF file, or Zarr store if the filename
+                    ends with .zarr
+        bands : list
+                    Names of the bands to write (default: all bands, see
+                    export_bands). Longitude and latitude are always
+                    written.
+        prefetch : bool
+                    Read the next block in a background thread while the
+                    current block is processed and written
+        writer : object
+                    Optional block writer with methods write(window, arrays)
+                    and close(). Defaults to a NetCDF or Zarr writer.
+        """
+        print('Calculating SAR wind with CMOD in blocks of %d pixels...' % self.block_size)
+        startTime = datetime.now()
+        if writer is None:
+            writer = self._writer(filename, bands=bands, zarr=filename.endswith('.zarr'))
+        windows = self.windows()
+        try:
+            if prefetch:
+                # GDAL releases the GIL while reading, so that reading
+                # overlaps with inversion and writing in the main thread
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    window = next(windows, None)
+                    future = executor.submit(self.read_block, window) if window else None
+                    while future is not None:
+                        block = future.result()
+                        window = next(windows, None)
+                        future = executor.submit(self.read_block, window) if window else None
+                        writer.write(block['window'], self.process_block(block))
+            else:
+                for window in windows:
+                    block = self.read_block(window)
+                    writer.write(window, self.process_block(block))
+        finally:
+            writer.close()
+        print('Calculation time: ' + str(datetime.now() - startTime))
+
+    def export_zarr(self, path, bands=None, prefetch=True):
+        """ Calculate wind block by block and write it to a Zarr store
+        at path, with one chunk per block (see export).
+        """
+        self.export(path, prefetch=prefetch, writer=self._writer(path, bands=bands, zarr=True))
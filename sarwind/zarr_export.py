@@ -0,0 +1,183 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+
+Export of SAR wind to chunked, compressed Zarr stores.
+
+The store is created once with create_store. Blocks can then be written
+with write_block (or ZarrBlockWriter) from parallel threads or processes,
+as long as each window is aligned with the chunks, so that no two
+workers write to the same chunk.
+
+The zarr package is an optional dependency.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sarwind.tiling import iter_windows
+
+
+def _import_zarr():
+    try:
+        import zarr
+    except ImportError:
+        raise ImportError('Export to Zarr requires the zarr package (pip install zarr)')
+    return zarr
+
+
+def _create_array(zarr, group, name, shape, chunks, dtype, fill_value):
+    if hasattr(group, 'create_array'):
+        # zarr >= 3
+        return group.create_array(
+            name, shape=shape, chunks=chunks, dtype=dtype, fill_value=fill_value,
+            compressors=zarr.codecs.BloscCodec(cname='zstd', clevel=5, shuffle='bitshuffle'),
+            dimension_names=('y', 'x'))
+    from numcodecs import Blosc
+    array = group.create_dataset(
+        name, shape=shape, chunks=chunks, dtype=dtype, fill_value=fill_value,
+        compressor=Blosc(cname='zstd', clevel=5, shuffle=Blosc.BITSHUFFLE))
+    # Dimension names for xarray
+    array.attrs['_ARRAY_DIMENSIONS'] = ['y', 'x']
+    return array
+
+
+def _attrs(metadata):
+    """ Convert metadata values to JSON serializable attributes.
+    """
+    attrs = {}
+    for key, val in metadata.items():
+        if isinstance(val, np.ndarray):
+            val = val.tolist()
+        elif isinstance(val, np.generic):
+            val = val.item()
+        elif not isinstance(val, (str, int, float, list)):
+            val = str(val)
+        attrs[key] = val
+    return attrs
+
+
+def create_store(path, shape, chunks, bands, metadata):
+    """ Create a Zarr store with empty 2D arrays.
+
+    Parameters
+    -----------
+    path : string
+                Path of the store (a directory on local disk)
+    shape : tuple
+                (y_size, x_size) of the arrays
+    chunks : int or tuple
+                Chunk size in pixels
+    bands : dict
+                Name of each array mapped to a dict with its attributes.
+                The keys 'dtype' and '_FillValue' give the data type
+                (default float32) and fill value (default NaN for floats).
+    metadata : dict
+                Global attributes
+    """
+    zarr = _import_zarr()
+    if np.isscalar(chunks):
+        chunks = (chunks, chunks)
+    chunks = (min(chunks[0], shape[0]), min(chunks[1], shape[1]))
+    group = zarr.open_group(path, mode='w')
+    for name, attrs in bands.items():
+        attrs = dict(attrs)
+        dtype = np.dtype(attrs.pop('dtype', 'f4'))
+        fill_value = attrs.pop('_FillValue', np.nan if dtype.kind == 'f' else 0)
+        array = _create_array(zarr, group, name, shape, chunks, dtype, fill_value)
+        array.attrs.update(_attrs(attrs))
+    group.attrs.update(_attrs(metadata))
+    return group
+
+
+def write_block(path, window, arrays):
+    """ Write arrays in a window (x_offset, y_offset, x_size, y_size) of
+    an existing Zarr store. The window must be aligned with the chunks.
+    """
+    zarr = _import_zarr()
+    x_off, y_off, x_size, y_size = window
+    group = zarr.open_group(path, mode='r+')
+    for name, array in arrays.items():
+        if name not in group:
+            continue
+        zarray = group[name]
+        _check_alignment(window, zarray.shape, zarray.chunks)
+        zarray[y_off:y_off + y_size, x_off:x_off + x_size] = array
+
+
+def _check_alignment(window, shape, chunks):
+    x_off, y_off, x_size, y_size = window
+    for off, size, n, chunk in [(y_off, y_size, shape[0], chunks[0]),
+                                (x_off, x_size, shape[1], chunks[1])]:
+        if off % chunk or (size % chunk and off + size != n):
+            raise ValueError('Window %s is not aligned with the chunks %s' % (
+                str(window), str(chunks)))
+
+
+class ZarrBlockWriter(object):
+    """ Write blocks of SAR wind bands to a Zarr store (same interface as
+    the NetCDF block writer in sarwind.windowed).
+    """
+
+    def __init__(self, path, shape, block_size, bands, metadata):
+        self.path = path
+        self.group = create_store(path, shape, block_size, bands, metadata)
+
+    def write(self, window, arrays):
+        for name, array in arrays.items():
+            if name in self.group:
+                self.group[name][window[1]:window[1] + window[3],
+                                 window[0]:window[0] + window[2]] = array
+
+    def close(self):
+        pass
+
+
+def export_zarr(n, path, bands=None, chunks=512, workers=4):
+    """ Export bands of a Nansat (e.g., SARWind) object, and its
+    geolocation and global metadata, to a Zarr store. Chunks are
+    compressed and written by parallel threads.
+
+    Parameters
+    -----------
+    n : Nansat
+                The object to export
+    path : string
+                Path of the store
+    bands : list
+                Band numbers or names to export (default: all bands)
+    chunks : int
+                Chunk size in pixels
+    workers : int
+                Number of threads writing chunks
+    """
+    if bands is None:
+        bands = list(n.bands().keys())
+    arrays = {}
+    band_attrs = {}
+    for band in bands:
+        metadata = n.get_metadata(band_id=band)
+        name = metadata['name']
+        arrays[name] = n[band]
+        attrs = {key: val for key, val in metadata.items()
+                 if key not in ['name', 'dataType', 'SourceFilename', 'SourceBand']}
+        attrs['dtype'] = arrays[name].dtype
+        if 'flag_masks' in attrs:
+            # Band metadata are strings, while CF requires numeric flag masks
+            attrs['flag_masks'] = np.array(attrs['flag_masks'].split(), dtype=attrs['dtype'])
+        attrs['coordinates'] = 'longitude latitude'
+        band_attrs[name] = attrs
+    arrays['longitude'], arrays['latitude'] = n.get_geolocation_grids()
+    band_attrs['longitude'] = {'standard_name': 'longitude', 'units': 'degree_east'}
+    band_attrs['latitude'] = {'standard_name': 'latitude', 'units': 'degree_north'}
+
+    shape = n.shape()
+    create_store(path, shape, chunks, band_attrs, n.get_metadata())
+
+    def write(window):
+        x_off, y_off, x_size, y_size = window
+        write_block(path, window, {name: array[y_off:y_off + y_size, x_off:x_off + x_size]
+                                   for name, array in arrays.items()})
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(write, iter_windows(shape[1], shape[0], chunks)))
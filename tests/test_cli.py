@@ -0,0 +1,84 @@
+import os
+import sys
+import pytest
+import subprocess
+
+from sarwind.cli import main
+from sarwind.cli import get_parser
+from sarwind.cli import product_filename
+
+
+@pytest.mark.unittests
+@pytest.mark.cli
+def test_batch_pending(fncDir, capsys):
+    """ Test that batch --pending lists the SAR images without products.
+    """
+    processed = '/path/to/S1A_EW_GRDM_1SDH_20221026T054324.SAFE'
+    pending = '/path/to/S1A_EW_GRDM_1SDH_20221026T054411.SAFE'
+    open(product_filename(processed, fncDir), 'w').close()
+
+    main(['batch', processed, pending, '-w', 'wind.nc', '-d', fncDir, '--pending'])
+    assert capsys.readouterr().out.split() == [pending]
+
+
+@pytest.mark.unittests
+@pytest.mark.cli
+def test_lazy_imports(rootDir, fncDir):
+    """ Test that short invocations do not import nansat or matplotlib.
+    """
+    code = (
+        "import sys; from sarwind.cli import main; "
+        "main(['batch', 'S1A.SAFE', '-w', 'wind.nc', '-d', %r, '--pending']); "
+        "print([m for m in ['nansat', 'osgeo', 'matplotlib', 'netCDF4'] if m in sys.modules])"
+        % fncDir)
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=rootDir)
+    assert out.decode().split('\n')[-2] == '[]'
+
+
+@pytest.mark.unittests
+@pytest.mark.cli
+def test_timing(fncDir, capsys):
+    """ Test that --timing reports startup time.
+    """
+    main(['--timing', 'batch', 'S1A.SAFE', '-d', fncDir, '--pending'])
+    assert 'startup:' in capsys.readouterr().err
+    assert os.listdir(fncDir) == []
+
+
+@pytest.mark.unittests
+@pytest.mark.cli
+def test_batch_wind(fncDir):
+    """ Test that the model wind file is only required for model wind
+    directions.
+    """
+    args = get_parser().parse_args(
+        ['batch', 'a.SAFE', 'b.SAFE', '--direction-source', 'sar', '-d', fncDir])
+    assert args.wind is None
+    assert args.sar_images == ['a.SAFE', 'b.SAFE']
+    with pytest.raises(SystemExit):
+        main(['batch', 'a.SAFE', '-d', fncDir])
+
+
+@pytest.mark.unittests
+@pytest.mark.cli
+def test_export_flag_masks(fncDir, monkeypatch):
+    """ Test that the export subcommand writes numeric flag_masks.
+    """
+    import netCDF4
+    import nansat.nansat
+
+    class FakeNansat(object):
+        def __init__(self, filename):
+            pass
+
+        def export(self, filename, bands=None):
+            with netCDF4.Dataset(filename, 'w') as ds:
+                ds.createDimension('x', 2)
+                var = ds.createVariable('qc_flags', 'u1', ('x',))
+                var.setncattr('flag_masks', '1 2 4 8')
+
+    monkeypatch.setattr(nansat.nansat, 'Nansat', FakeNansat)
+    output = os.path.join(fncDir, 'exported.nc')
+    main(['export', 'product.nc', output])
+    with netCDF4.Dataset(output) as ds:
+        assert list(ds['qc_flags'].flag_masks) == [1, 2, 4, 8]
@@ -0,0 +1,135 @@
+import os
+import pytest
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils import collocation
+from utils.collocation import GeolocationIndex
+from utils.collocation import extract_points
+from utils.collocation import get_index
+
+
+@pytest.mark.unittests
+@pytest.mark.collocation
+def testGeolocationIndex_query():
+    """ Test that the nearest pixels are found, also across the
+    antimeridian, and that points far away are not matched.
+    """
+    lon, lat = np.meshgrid(np.array([178., 179., 180., -179.]), np.array([60., 61., 62.]))
+    lon[0, 0] = np.nan
+    index = GeolocationIndex(lon, lat)
+
+    rows, cols, distance = index.query(
+        np.array([-179.1, 179.9, 178.]), np.array([61.1, 60., 60.]), max_distance=20000.)
+    assert list(rows) == [1, 0, -1]
+    assert list(cols) == [3, 2, -1]
+    assert distance[0] < 20000.
+    assert distance[1] < 10000.
+    assert np.isnan(distance[2])
+
+
+class FakeProduct(object):
+    """ A SAR wind product on a regular longitude/latitude grid.
+    """
+
+    def __init__(self, lon0=5., time=datetime.datetime(2022, 10, 26, 6)):
+        self.lon, self.lat = np.meshgrid(lon0 + 0.01*np.arange(4), 70. + 0.01*np.arange(3))
+        self.time_coverage_start = time
+        self.bands = {
+            'windspeed': np.arange(12.).reshape(3, 4),
+            'winddirection': np.full((3, 4), 90.),
+            'valid': np.ones((3, 4)),
+        }
+        self.geolocation_calls = 0
+
+    def shape(self):
+        return self.lon.shape
+
+    def get_geolocation_grids(self):
+        self.geolocation_calls += 1
+        return self.lon, self.lat
+
+    def has_band(self, band):
+        return band in self.bands
+
+    def __getitem__(self, band):
+        return self.bands[band]
+
+
+@pytest.fixture
+def products(fncDir, monkeypatch):
+    """ Two fake products, 100 km apart and one day apart.
+    """
+    fakes = {
+        os.path.join(fncDir, 'a.nc'): FakeProduct(),
+        os.path.join(fncDir, 'b.nc'): FakeProduct(
+            lon0=8., time=datetime.datetime(2022, 10, 27, 6)),
+    }
+    for fn in fakes:
+        open(fn, 'w').close()
+    monkeypatch.setattr(collocation, '_open_product', lambda fn: fakes[fn])
+    monkeypatch.setattr(collocation, '_index_cache', {})
+    return fakes
+
+
+@pytest.mark.unittests
+@pytest.mark.collocation
+@pytest.mark.parametrize('workers', [1, None])
+def test_extract_points(products, workers):
+    """ Test that points are matched with the products within the time
+    window and distance, and that the output has the expected columns.
+    """
+    points = pd.DataFrame({
+        'station': ['A', 'B', 'C', 'D'],
+        'lon': [5.01, 5.01, 8.03, 20.],
+        'lat': [70.01, 70.01, 70.02, 70.],
+        'time': pd.to_datetime(['2022-10-26T06:30', '2022-10-26T08:00',
+                                '2022-10-27T05:30', '2022-10-26T06:00'])})
+    table = extract_points(sorted(products), points, workers=workers)
+
+    assert list(table.columns) == [
+        'product', 'product_time', 'row', 'col', 'distance', 'station', 'lon', 'lat', 'time',
+        'windspeed', 'winddirection', 'model_windspeed', 'valid']
+    assert list(table['station']) == ['A', 'C']
+    assert list(table['product']) == ['a.nc', 'b.nc']
+    assert list(table['windspeed']) == [5., 11.]
+    assert list(table['valid']) == [True, True]
+    assert table['model_windspeed'].isna().all()
+    assert (table['distance'] < 1000.).all()
+
+    # Indices are cached in memory, also with parallel workers
+    extract_points(sorted(products), points, workers=workers)
+    assert [p.geolocation_calls for p in products.values()] == [1, 1]
+
+    empty = extract_points(sorted(products), points.iloc[3:], workers=workers)
+    assert empty.empty
+    assert list(empty.columns) == list(table.columns)
+
+
+@pytest.mark.unittests
+@pytest.mark.collocation
+def test_get_index_cache_dir(products, fncDir, monkeypatch):
+    """ Test that indices cached on disk are not mixed up between
+    products with the same filename, and are rebuilt if their shape
+    does not match the product.
+    """
+    cache_dir = os.path.join(fncDir, 'cache')
+    fn = sorted(products)[0]
+    get_index(fn, cache_dir=cache_dir)
+
+    other_dir = os.path.join(fncDir, 'reprocessed')
+    os.mkdir(other_dir)
+    other = os.path.join(other_dir, 'a.nc')
+    open(other, 'w').close()
+    reprocessed = FakeProduct()
+    reprocessed.lon, reprocessed.lat = reprocessed.lon[:2], reprocessed.lat[:2]
+    index = get_index(other, n=reprocessed, cache_dir=cache_dir)
+    assert index.shape == (2, 4)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # An index of another shape in the cache file is rebuilt
+    monkeypatch.setattr(collocation, '_index_cache', {})
+    products[fn].lon, products[fn].lat = reprocessed.lon, reprocessed.lat
+    assert get_index(fn, cache_dir=cache_dir).shape == (2, 4)
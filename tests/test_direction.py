@@ -0,0 +1,112 @@
+import pytest
+
+import numpy as np
+
+from sarwind.direction import resolve_ambiguity
+from sarwind.direction import sar_wind_direction
+from sarwind.direction import streak_bearings
+
+
+def streaks(phase):
+    """ Synthetic sigma0 with streaks along lines of constant phase
+    (in pixels), and some noise.
+    """
+    rng = np.random.default_rng(0)
+    return 0.05*(1 + 0.3*np.sin(2*np.pi*phase/6.)) * (1 + 0.05*rng.standard_normal(phase.shape))
+
+
+@pytest.fixture(scope="module")
+def grid():
+    """ Longitude and latitude of a north-up image near the equator,
+    with square pixels. Columns increase eastwards and rows southwards.
+    """
+    y, x = np.mgrid[0:60, 0:80]
+    lon = 5. + 0.002*x
+    lat = 0.1 - 0.002*y
+    return x, y, lon, lat
+
+
+@pytest.mark.unittests
+@pytest.mark.direction
+def test_sar_wind_direction_north_up(grid):
+    """ Test that streaks are detected with the right orientation, and
+    that the ambiguity is resolved with the prior.
+    """
+    x, y, lon, lat = grid
+    # Streaks along the columns, i.e., north-south
+    direction, coherence = sar_wind_direction(
+        streaks(x), lon, lat, prior=170., window_size=11, block_size=32)
+    assert np.all(coherence[10:-10, 10:-10] > 0.5)
+    np.testing.assert_allclose(direction[10:-10, 10:-10], 180., atol=5)
+
+    # Streaks towards the upper right, i.e., northeast-southwest
+    direction, coherence = sar_wind_direction(
+        streaks(x + y), lon, lat, prior=np.full(x.shape, 30.), window_size=11, block_size=32)
+    np.testing.assert_allclose(direction[10:-10, 10:-10], 45., atol=5)
+    direction, coherence = sar_wind_direction(
+        streaks(x + y), lon, lat, prior=250., window_size=11, block_size=32)
+    np.testing.assert_allclose(direction[10:-10, 10:-10], 225., atol=5)
+
+
+@pytest.mark.unittests
+@pytest.mark.direction
+def test_sar_wind_direction_mirrored(grid):
+    """ Test that directions are right for images where columns increase
+    westwards (e.g., mirrored SAR images).
+    """
+    x, y, lon, lat = grid
+    direction, coherence = sar_wind_direction(
+        streaks(x + y), 2*lon.mean() - lon, lat, prior=300., window_size=11)
+    np.testing.assert_allclose(direction[10:-10, 10:-10], 315., atol=5)
+
+
+@pytest.mark.unittests
+@pytest.mark.direction
+def test_sar_wind_direction_masked(grid):
+    """ Test that invalid (NaN) pixels, e.g., land, do not disturb the
+    streak orientation next to them.
+    """
+    x, y, lon, lat = grid
+    sigma0 = streaks(x)
+    # Land along the upper rows, masked as invalid
+    sigma0[:20] = np.nan
+    direction, coherence = sar_wind_direction(
+        sigma0, lon, lat, prior=170., window_size=11, block_size=32)
+    assert np.all(np.isnan(coherence[:20]))
+    np.testing.assert_allclose(direction[20:-10, 10:-10], 180., atol=5)
+
+
+@pytest.mark.unittests
+@pytest.mark.direction
+def test_sar_wind_direction_incoherent(grid):
+    """ Test that the prior is used where there are no coherent streaks,
+    and that the direction is NaN there without prior.
+    """
+    x, y, lon, lat = grid
+    sigma0 = 0.05*np.exp(0.3*np.random.default_rng(1).standard_normal(x.shape))
+    direction, coherence = sar_wind_direction(sigma0, lon, lat, prior=123.)
+    assert np.median(coherence) < 0.2
+    assert np.mean(direction == 123.) > 0.95
+
+    with pytest.warns(UserWarning):
+        direction, coherence = sar_wind_direction(sigma0, lon, lat)
+    assert np.mean(np.isnan(direction)) > 0.95
+
+    orientation, coherence = streak_bearings(streaks(x + y), lon, lat, window_size=11)
+    assert np.all(orientation[10:-10, 10:-10] < 180.)
+    np.testing.assert_allclose(orientation[10:-10, 10:-10], 45., atol=5)
+
+
+@pytest.mark.unittests
+@pytest.mark.direction
+def test_resolve_ambiguity():
+    """ Test that the direction closest to the prior is chosen, that the
+    prior is used for missing orientations, and that a warning is given
+    without prior.
+    """
+    orientation = np.array([10., 100., 170., np.nan])
+    np.testing.assert_allclose(
+        resolve_ambiguity(orientation, prior=np.array([200., 90., 340., 20.])),
+        [190., 100., 350., 20.])
+    with pytest.warns(UserWarning):
+        np.testing.assert_allclose(resolve_ambiguity(orientation + 180.), orientation)
@@ -0,0 +1,64 @@
+import os
+import pytest
+
+import numpy as np
+
+from sarwind.geocache import scene_id
+from sarwind.geocache import scene_format
+from sarwind.geocache import SceneCache
+
+
+@pytest.mark.unittests
+@pytest.mark.geocache
+def test_scene_id(sarEW_SAFE, sarEW_NBS):
+    """ Test that the scene ID is the filename without extensions.
+    """
+    assert scene_id(sarEW_SAFE) == \
+        'S1A_EW_GRDM_1SDH_20221026T054324_20221026T054411_045609_05740B_6B3F'
+    assert scene_id(sarEW_NBS) == \
+        'S1A_EW_GRDM_1SDH_20210324T035507_20210324T035612_037135_045F42_5B4C'
+    assert scene_id('/path/to/S1A_IW_GRDH.SAFE/') == 'S1A_IW_GRDH'
+    assert scene_format(sarEW_NBS) == 'NBS.nc'
+    assert scene_format('/path/to/S1A_IW_GRDH.SAFE/') == 'SAFE'
+
+
+@pytest.mark.unittests
+@pytest.mark.geocache
+def testSceneCache_save_load(sarEW_SAFE, fncDir):
+    """ Test that arrays are cached per scene and pixel size, and
+    loaded memory-mapped.
+    """
+    cache = SceneCache(fncDir, sarEW_SAFE, 500)
+    assert not cache.has('longitude')
+
+    lon = np.linspace(0, 10, 12).reshape(3, 4)
+    cache.save('longitude', lon)
+    assert cache.has('longitude')
+    assert not SceneCache(fncDir, sarEW_SAFE, 1000).has('longitude')
+    # Other formats of the same scene are cached separately
+    assert not SceneCache(fncDir, sarEW_SAFE.replace('.SAFE.nc', '.zip'), 500).has('longitude')
+    assert os.listdir(cache.path) == ['longitude.npy']
+
+    cached = cache.load('longitude')
+    assert isinstance(cached, np.memmap)
+    assert cached.dtype == np.float32
+    np.testing.assert_allclose(cached, lon, rtol=1e-6)
+
+
+@pytest.mark.unittests
+@pytest.mark.geocache
+def testSceneCache_stale(fncDir):
+    """ Test that arrays cached before the SAR image was modified are not
+    used, and that the pixel size gives the same cache for int and float.
+    """
+    sar_image = os.path.join(fncDir, 'S1A_IW_GRDH.SAFE.nc')
+    open(sar_image, 'w').close()
+    cache = SceneCache(os.path.join(fncDir, 'cache'), sar_image, 500)
+    assert SceneCache(os.path.join(fncDir, 'cache'), sar_image, 500.).path == cache.path
+    cache.save('longitude', np.zeros((2, 2)))
+    assert cache.has('longitude')
+
+    # Reprocessed SAR image
+    mtime = os.path.getmtime(cache.filename('longitude'))
+    os.utime(sar_image, (mtime + 10, mtime + 10))
+    assert not SceneCache(os.path.join(fncDir, 'cache'), sar_image, 500).has('longitude')
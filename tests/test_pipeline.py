@@ -0,0 +1,53 @@
+import pytest
+import threading
+
+from sarwind.pipeline import Pipeline
+
+
+class FakePipeline(Pipeline):
+    """ Pipeline with stages that record their calls instead of
+    processing SAR images.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FakePipeline, self).__init__(*args, **kwargs)
+        self.b_loaded = threading.Event()
+        self.exported = []
+        self.overlapped = False
+
+    def load(self, sar_image, wind):
+        if sar_image == 'fail.SAFE':
+            raise ValueError('Cannot open ' + sar_image)
+        if sar_image == 'b.SAFE':
+            self.b_loaded.set()
+        return sar_image
+
+    def process(self, w):
+        # The next scene is loaded while this one is processed
+        if w == 'a.SAFE':
+            self.overlapped = self.b_loaded.wait(5)
+        return w.upper()
+
+    def export(self, w, output):
+        self.exported.append((w, output))
+
+
+@pytest.mark.unittests
+@pytest.mark.pipeline
+def testPipeline_run():
+    """ Test that all scenes pass through the stages in order, that
+    loading overlaps with processing, and that failed scenes are
+    reported without stopping the pipeline.
+    """
+    p = FakePipeline(queue_size=1)
+    results = p.run([
+        ('a.SAFE', 'wind.nc', 'a.nc'),
+        ('fail.SAFE', 'wind.nc', 'fail.nc'),
+        ('b.SAFE', 'wind.nc', 'b.nc'),
+    ])
+    assert p.exported == [('A.SAFE', 'a.nc'), ('B.SAFE', 'b.nc')]
+    assert p.overlapped
+    errors = {r['sar_image']: r['error'] for r in results}
+    assert len(errors) == 3
+    assert errors['a.SAFE'] is None
+    assert isinstance(errors['fail.SAFE'], ValueError)
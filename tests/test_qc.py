@@ -0,0 +1,90 @@
+import pytest
+
+import numpy as np
+
+from sarwind.cmod5n import cmod5n_forward
+from sarwind.qc import box_sum
+from sarwind.qc import flag_masks
+from sarwind.qc import local_variance
+from sarwind.qc import qc_flags
+from sarwind.qc import FLAG_INVALID
+from sarwind.qc import FLAG_MODEL_DIFFERENCE
+from sarwind.qc import FLAG_LOCAL_VARIANCE
+from sarwind.qc import FLAG_INVERSION_RESIDUAL
+
+
+@pytest.mark.unittests
+@pytest.mark.qc
+def test_box_sum():
+    """ Test that the summed-area table gives the same moving window
+    sums as a brute force calculation.
+    """
+    a = np.random.default_rng(1).random((7, 9))
+    padded = np.pad(a, 1)
+    expected = np.array([[padded[i:i + 3, j:j + 3].sum() for j in range(9)] for i in range(7)])
+    np.testing.assert_allclose(box_sum(a, 3), expected)
+
+    with pytest.raises(ValueError):
+        box_sum(a, 2)
+
+
+@pytest.mark.unittests
+@pytest.mark.qc
+def test_local_variance():
+    """ Test that the local variance ignores NaNs, is zero for a
+    constant field, and is NaN where too few pixels are finite.
+    """
+    a = np.full((10, 10), 7.)
+    a[2, 3] = np.nan
+    var = local_variance(a, 5, min_count=1)
+    np.testing.assert_allclose(var, 0., atol=1e-10)
+    # Only 9 of 25 pixels in the window at the corners
+    assert np.isnan(local_variance(a, 5)[0, 0])
+
+    a[5, 5] = 12.
+    var = local_variance(a, 3)
+    assert var[5, 5] > 0
+    assert var[1, 1] == pytest.approx(0., abs=1e-10)
+
+
+@pytest.mark.unittests
+@pytest.mark.qc
+def test_qc_flags():
+    """ Test that each of the flags is raised where expected.
+    """
+    shape = (9, 9)
+    windspeed = np.full(shape, 8.)
+    winddir = np.full(shape, 45.)
+    look_dir = np.zeros(shape)
+    inc = np.full(shape, 30.)
+    s0vv = cmod5n_forward(windspeed, winddir - look_dir, inc)
+    model_windspeed = np.full(shape, 8.)
+    valid = np.ones(shape)
+
+    valid[0, 0] = 0
+    model_windspeed[8, 8] = 20.
+    windspeed[4, 4] = 25.
+    s0vv[8, 0] = s0vv[8, 0]*10
+    windspeed[2, 7] = np.nan
+
+    flags = qc_flags(windspeed, model_windspeed, s0vv, look_dir, winddir, inc, valid=valid)
+
+    assert flags[0, 0] & FLAG_INVALID
+    assert flags[8, 8] == FLAG_MODEL_DIFFERENCE
+    assert flags[4, 4] & FLAG_LOCAL_VARIANCE
+    assert flags[4, 4] & FLAG_MODEL_DIFFERENCE
+    assert flags[8, 0] == FLAG_INVERSION_RESIDUAL
+    # The inversion residual is not evaluated for invalid pixels
+    assert flags[2, 7] == FLAG_INVALID
+    assert flags[1, 7] == 0
+
+
+@pytest.mark.unittests
+@pytest.mark.qc
+def test_flag_masks():
+    """ Test that the flag masks are numeric, with the given type.
+    """
+    masks = flag_masks()
+    assert masks.dtype == np.uint8
+    assert list(masks) == [FLAG_INVALID, FLAG_MODEL_DIFFERENCE, FLAG_LOCAL_VARIANCE,
+                           FLAG_INVERSION_RESIDUAL]
@@ -0,0 +1,95 @@
+import os
+import re
+import pytest
+import threading
+import urllib.parse
+
+from http.server import HTTPServer
+from http.server import BaseHTTPRequestHandler
+
+from sardata.sardata import SARData
+
+
+ENTRY = """<entry>
+<title>S1A_EW_GRDM_1SDH_20221026T%06d</title>
+<link href="https://colhub.met.no/odata/v1/Products('%d')/$value"/>
+<link rel="icon" href="https://colhub.met.no/odata/v1/Products('%d')/Products('Quicklook')"/>
+<date name="ingestiondate">%s</date>
+<str name="producttype">GRD</str>
+</entry>"""
+
+
+class FakeCatalogue(BaseHTTPRequestHandler):
+    """ Fake OpenSearch catalogue, with entries sorted by ingestion
+    date.
+    """
+    entries = []
+    requests = []
+
+    def do_GET(self):
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        self.requests.append(params)
+        entries = self.entries
+        since = re.search(r'ingestiondate:\[(\S+) TO NOW\]', params['q'][0])
+        if since:
+            entries = [e for e in entries if e[1] >= since.group(1)]
+        start = int(params['start'][0])
+        rows = int(params['rows'][0])
+        body = '<?xml version="1.0" encoding="utf-8"?>\n'
+        body += '<feed xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" '
+        body += 'xmlns="http://www.w3.org/2005/Atom">\n'
+        body += '<opensearch:totalResults>%d</opensearch:totalResults>\n' % len(entries)
+        for i, date in entries[start:start + rows]:
+            body += ENTRY % (i, i, i, date) + '\n'
+        body += '</feed>\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def catalogue():
+    FakeCatalogue.entries = [
+        (i, '2022-10-26T%02d:%02d:00.000Z' % (6 + i//60, i % 60)) for i in range(250)]
+    FakeCatalogue.requests = []
+    server = HTTPServer(('127.0.0.1', 0), FakeCatalogue)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d/' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unittests
+@pytest.mark.sardata
+def testSARData_query_catalogue_pages_and_cursor(catalogue, fncDir):
+    """ Test that all result pages are fetched, and that a repeated
+    query only fetches entries ingested since the previous one.
+    """
+    s = SARData(date_str='2022-10-26')
+    cursor_file = os.path.join(fncDir, 'cursors.json')
+    start = '2022-10-26T02:00:00.000Z'
+    stop = '2022-10-26T09:30:59.999Z'
+
+    entries = list(s.query_catalogue(start, stop, url=catalogue, cursor_file=cursor_file))
+    assert len(entries) == 250
+    assert len(FakeCatalogue.requests) == 3
+    assert entries[0]['title'] == 'S1A_EW_GRDM_1SDH_20221026T000000'
+    assert entries[0]['link'] == "https://colhub.met.no/odata/v1/Products('0')/$value"
+    assert entries[-1]['ingestiondate'] == '2022-10-26T10:09:00.000Z'
+    assert 'ingestiondate' not in FakeCatalogue.requests[0]['q'][0]
+
+    FakeCatalogue.entries.append((250, '2022-10-26T10:10:00.000Z'))
+    FakeCatalogue.requests = []
+    entries = list(s.query_catalogue(start, stop, url=catalogue, cursor_file=cursor_file))
+    assert [e['title'][-3:] for e in entries] == ['249', '250']
+    assert len(FakeCatalogue.requests) == 1
+
+    # Other AOIs do not share the cursor
+    s.ULY = 85.
+    entries = list(s.query_catalogue(start, stop, url=catalogue, cursor_file=cursor_file))
+    assert len(entries) == 251
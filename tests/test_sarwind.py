@@ -1,9 +1,15 @@
+import os
 import pytest
 import datetime
 
 import numpy as np
+import netCDF4
 
+from nansat.nansat import Nansat
+
+import sarwind.sarwind
 from sarwind.sarwind import SARWind
+from sarwind.sarwind import azimuth_y
 
 
 @pytest.mark.unittests
@@ -79,3 +85,314 @@ def testSARWind_using_s1IWDVsafe_meps_filenames(sarIW_SAFE, meps):
     """
     w = SARWind(sarIW_SAFE, meps)
     assert type(w) == SARWind
+
+
+@pytest.mark.safe
+@pytest.mark.sarwind
+def testSARWind_cache_dir(sarIW_SAFE, meps, fncDir, monkeypatch):
+    """ Test that wind calculated with cached geometry, sigma0 and valid
+    pixels equals the uncached wind, and that the cached geometry is
+    used instead of reading the SAR image bands on later runs.
+    """
+    cache_dir = os.path.join(fncDir, 'cache')
+    w = SARWind(sarIW_SAFE, meps)
+    w1 = SARWind(sarIW_SAFE, meps, cache_dir=cache_dir)
+
+    reads = []
+    getitem = Nansat.__getitem__
+    get_geolocation_grids = Nansat.get_geolocation_grids
+    azimuth_y = Nansat.azimuth_y
+
+    def spy_getitem(self, band_id):
+        reads.append(band_id)
+        return getitem(self, band_id)
+
+    def spy_get_geolocation_grids(self, *args, **kwargs):
+        if isinstance(self, SARWind):
+            reads.append('geolocation')
+        return get_geolocation_grids(self, *args, **kwargs)
+
+    def spy_azimuth_y(self, *args, **kwargs):
+        reads.append('azimuth_y')
+        return azimuth_y(self, *args, **kwargs)
+
+    with monkeypatch.context() as mp:
+        mp.setattr(SARWind, "__getitem__", spy_getitem)
+        mp.setattr(SARWind, "watermask",
+                   lambda *a, **kw: pytest.fail('Valid pixels should be cached'))
+        mp.setattr(Nansat, "get_geolocation_grids", spy_get_geolocation_grids)
+        mp.setattr(Nansat, "azimuth_y", spy_azimuth_y)
+        w2 = SARWind(sarIW_SAFE, meps, cache_dir=cache_dir)
+
+    geometry_bands = ['incidence_angle', 'geolocation', 'azimuth_y', w.sigma0_bandNo,
+                      w.get_band_number({'standard_name': 'sensor_azimuth_angle'})]
+    assert [band for band in reads if band in geometry_bands] == []
+
+    np.testing.assert_array_equal(w1['valid'], w['valid'])
+    np.testing.assert_array_equal(w2['valid'], w['valid'])
+    np.testing.assert_allclose(w2['windspeed'], w1['windspeed'], equal_nan=True)
+    # Cached arrays are float32
+    np.testing.assert_allclose(w2['windspeed'], w['windspeed'], atol=0.05, equal_nan=True)
+
+
+class MockSARWindBands(object):
+    """ Band storage for testing SARWind methods without a SAR image.
+    Arrays are stored by band name, and band numbers are given in order
+    of addition.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = dict(arrays)
+        self.numbers = {name: i + 1 for i, name in enumerate(self.arrays)}
+        self.deleted = []
+        self.vrt = self
+
+    def add(self, name, array):
+        self.arrays[name] = array
+        self.numbers[name] = max(self.numbers.values(), default=0) + 1
+
+    def get_band_number(self, band):
+        if isinstance(band, dict):
+            # Bands added with a wkv are named by their standard name
+            band = band.get('standard_name')
+        if band not in self.arrays:
+            raise ValueError('Cannot find band %s' % str(band))
+        return self.numbers[band]
+
+    def delete_bands(self, band_nums):
+        for name, num in list(self.numbers.items()):
+            if num in band_nums:
+                self.deleted.append(name)
+                del self.arrays[name]
+                del self.numbers[name]
+
+    def patch(self, mp):
+        """ Patch the band methods of SARWind, and the reading of SAR
+        image bands, which should not happen.
+        """
+        def getitem(n, band):
+            if band not in self.arrays:
+                pytest.fail('SAR image band %s should not be read' % str(band))
+            return self.arrays[band]
+
+        def add_band(n, array=None, parameters=None, **kw):
+            self.add(parameters.get('name', parameters.get('wkv')), array)
+
+        mp.setattr(SARWind, "__init__", lambda *a: None)
+        mp.setattr(SARWind, "get_band_number", lambda n, band: self.get_band_number(band))
+        mp.setattr(SARWind, "has_band", lambda n, band: band in self.arrays)
+        mp.setattr(SARWind, "__getitem__", getitem)
+        mp.setattr(SARWind, "add_band", add_band)
+        mp.setattr(SARWind, "get_metadata", lambda n, **kw: '2022-10-26T06:00:00')
+        mp.setattr(SARWind, "set_metadata", lambda n, key, val: None)
+        mp.setattr(SARWind, "_update_history", lambda n: None)
+        mp.setattr(SARWind, "_get_geometry",
+                   lambda n, name: pytest.fail('SAR geometry should be reused'))
+
+
+@pytest.mark.unittests
+@pytest.mark.sarwind
+def testSARWind_update_wind(monkeypatch):
+    """ Test that SARWind.update_wind deletes the wind bands, and
+    recalculates wind with the new model wind from the SAR inputs that
+    were already read.
+    """
+    shape = (3, 4)
+    mock = MockSARWindBands({
+        'valid': np.ones(shape),
+        'winddirection': np.full(shape, 90.),
+        'model_windspeed': np.full(shape, 8.),
+        'windspeed': np.full(shape, 8.),
+        'eastward_wind': np.full(shape, 8.),
+        'qc_flags': np.zeros(shape),
+    })
+    inputs = {
+        'sigma0_vv': np.full(shape, 0.05),
+        'incidence_angle': np.full(shape, 30.),
+        'sensor_azimuth_angle': np.zeros(shape),
+    }
+    load_inputs = SARWind.load_inputs
+    calls = []
+
+    def spy_load_inputs(self):
+        calls.append('load_inputs')
+        return load_inputs(self)
+
+    def mock_set_aux_wind(self, wind, **kw):
+        calls.append(('set_aux_wind', wind))
+        mock.add('winddirection', np.full(shape, 270.))
+        mock.add('model_windspeed', np.full(shape, 10.))
+
+    with monkeypatch.context() as mp:
+        mock.patch(mp)
+        mp.setattr(SARWind, "set_aux_wind", mock_set_aux_wind)
+        mp.setattr(SARWind, "load_inputs", spy_load_inputs)
+
+        n = SARWind()
+        n.vrt = mock
+        n.direction_source = 'model'
+        n.time_coverage_start = datetime.datetime(2022, 10, 26, 6)
+        n._inputs = inputs
+        n.update_wind('path/to/new_wind_field_file.nc')
+
+        assert sorted(mock.deleted) == [
+            'eastward_wind', 'model_windspeed', 'qc_flags', 'winddirection', 'windspeed']
+        assert calls == [('set_aux_wind', 'path/to/new_wind_field_file.nc'), 'load_inputs']
+        assert n._inputs is inputs
+        assert np.all(mock.arrays['windspeed'] > 0)
+        assert 'qc_flags' in mock.arrays
+
+        with pytest.raises(ValueError):
+            n.update_wind(1)
+
+
+@pytest.mark.unittests
+@pytest.mark.sarwind
+def testSARWind_update_wind_sar_direction(monkeypatch):
+    """ Test that SARWind.update_wind reuses the wind streaks, and only
+    resolves the 180 degree ambiguity with the new model wind.
+    """
+    shape = (1, 2)
+    mock = MockSARWindBands({
+        'model_winddirection': np.full(shape, 200.),
+        'winddirection': np.array([[190., 280.]]),
+        'streak_coherence': np.full(shape, 0.6),
+        'windspeed': np.full(shape, 8.),
+    })
+
+    def mock_set_aux_wind(self, wind, **kw):
+        mock.add('winddirection', np.full(shape, 20.))
+
+    with monkeypatch.context() as mp:
+        mock.patch(mp)
+        mp.setattr(SARWind, "set_aux_wind", mock_set_aux_wind)
+        mp.setattr(SARWind, "set_sar_wind_direction",
+                   lambda self: pytest.fail('Wind streaks should be reused'))
+        mp.setattr(SARWind, "_calculate_wind", lambda self: None)
+
+        n = SARWind()
+        n.vrt = mock
+        n.direction_source = 'sar'
+        n.time_coverage_start = datetime.datetime(2022, 10, 26, 6)
+        n._streak_orientation = np.array([[10., 100.]])
+        n.update_wind('path/to/new_wind_field_file.nc')
+
+        assert 'streak_coherence' not in mock.deleted
+        np.testing.assert_allclose(mock.arrays['winddirection'], [[10., 100.]])
+        np.testing.assert_allclose(mock.arrays['model_winddirection'], 20.)
+
+
+@pytest.mark.unittests
+@pytest.mark.sarwind
+def testSARWind_export_flag_masks(monkeypatch, fncDir):
+    """ Test that SARWind.export writes numeric flag_masks, as required
+    by CF, although the band metadata are strings.
+    """
+    def mock_export(self, filename, bands=None, **kwargs):
+        with netCDF4.Dataset(filename, 'w') as ds:
+            ds.createDimension('x', 2)
+            var = ds.createVariable('qc_flags', 'u1', ('x',))
+            var.setncattr('flag_masks', '1 2 4 8')
+
+    with monkeypatch.context() as mp:
+        mp.setattr(SARWind, "__init__", lambda *a: None)
+        mp.setattr(SARWind, "get_bands_to_export", lambda self, bands: bands)
+        mp.setattr(Nansat, "export", mock_export)
+
+        fn = os.path.join(fncDir, 'sarwind.nc')
+        SARWind().export(fn)
+        with netCDF4.Dataset(fn) as ds:
+            flag_masks = ds['qc_flags'].flag_masks
+        assert flag_masks.dtype == np.uint8
+        assert list(flag_masks) == [1, 2, 4, 8]
+
+
+@pytest.mark.unittests
+@pytest.mark.sarwind
+def test_azimuth_y():
+    """ Test the azimuth of the y-axis of north-up and rotated grids.
+    """
+    lon, lat = np.meshgrid(5. + 0.01*np.arange(4), 70. - 0.01*np.arange(3))
+    az = azimuth_y(lon, lat)
+    assert az.shape == lon.shape
+    np.testing.assert_allclose(np.mod(az + 180., 360.) - 180., 0., atol=1e-6)
+    # Rows increasing westwards, i.e., the y-axis points east
+    row, col = np.mgrid[0:3, 0:4]
+    np.testing.assert_allclose(azimuth_y(5. - 0.01*row, 70. + 0.01*col), 90., atol=0.1)
+
+
+@pytest.mark.unittests
+@pytest.mark.sarwind
+def testSARWind_sar_direction_pixelsize():
+    """ Test that SAR wind directions are refused for pixel sizes that
+    are too coarse to resolve wind streaks.
+    """
+    with pytest.raises(ValueError):
+        SARWind('sar.SAFE', None, pixelsize=500, direction_source='sar')
+    with pytest.raises(ValueError):
+        SARWind('sar.SAFE', None, pixelsize=100)
+
+
+@pytest.mark.unittests
+@pytest.mark.sarwind
+def testSARWind_set_sar_wind_direction(monkeypatch):
+    """ Test that wind streaks are only estimated over valid pixels, and
+    that the model wind direction is kept as model_winddirection.
+    """
+    bands = {
+        'valid': np.array([[1, 1], [0, 1]]),
+        'winddirection': np.full((2, 2), 200.),
+    }
+    streak_input = []
+
+    def mock_streak_bearings(s0vv, lon, lat, **kwargs):
+        streak_input.append(s0vv)
+        return np.array([[10., np.nan], [np.nan, 100.]]), np.array([[.5, .1], [np.nan, .6]])
+
+    class MockVRT:
+        def delete_bands(self, band_nums):
+            del bands['winddirection']
+
+    with monkeypatch.context() as mp:
+        mp.setattr(SARWind, "__init__", lambda *a: None)
+        mp.setattr(SARWind, "has_band", lambda self, band: band in bands)
+        mp.setattr(SARWind, "__getitem__", lambda self, band: bands[band])
+        mp.setattr(SARWind, "get_metadata", lambda self, **kw: '2022-10-26T06:00:00')
+        mp.setattr(SARWind, "get_band_number", lambda self, band: 3)
+        mp.setattr(SARWind, "add_band",
+                   lambda self, array, parameters: bands.update({parameters['name']: array}))
+        mp.setattr(SARWind, "get_geolocation_grids", lambda self: (None, None))
+        mp.setattr(sarwind.sarwind, "streak_bearings", mock_streak_bearings)
+
+        n = SARWind()
+        n.vrt = MockVRT()
+        n.time_coverage_start = datetime.datetime(2022, 10, 26, 6)
+        n._inputs = {'sigma0_vv': np.full((2, 2), 0.05)}
+        n.set_sar_wind_direction()
+
+        np.testing.assert_array_equal(streak_input[0], [[0.05, 0.05], [np.nan, 0.05]])
+        np.testing.assert_array_equal(bands['model_winddirection'], 200.)
+        np.testing.assert_allclose(bands['winddirection'], [[190., 200.], [200., 280.]])
+        assert 'streak_coherence' in bands
+
+
+@pytest.mark.safe
+@pytest.mark.sarwind
+def testSARWind_load_inputs_then_process(sarIW_SAFE, meps, monkeypatch):
+    """ Test that loading the inputs (as in the load stage of
+    sarwind.pipeline) and processing later gives the same wind as the
+    default constructor, and that the watermask is read when loading.
+    """
+    w = SARWind(sarIW_SAFE, meps)
+    wp = SARWind(sarIW_SAFE, meps, process=False)
+    wp.load_inputs()
+    assert wp.has_band('valid')
+
+    with monkeypatch.context() as mp:
+        mp.setattr(SARWind, "watermask",
+                   lambda *a, **kw: pytest.fail('The watermask should be read when loading'))
+        wp.process()
+
+    np.testing.assert_array_equal(wp['valid'], w['valid'])
+    np.testing.assert_array_equal(wp['windspeed'], w['windspeed'])
+    np.testing.assert_array_equal(wp['qc_flags'], w['qc_flags'])
@@ -0,0 +1,73 @@
+import os
+import pytest
+
+import numpy as np
+
+from sarwind.tiling import iter_windows
+
+
+@pytest.mark.unittests
+@pytest.mark.windowed
+def test_iter_windows():
+    """ Test that the windows cover the raster exactly once.
+    """
+    windows = list(iter_windows(5, 3, 2))
+    assert windows == [
+        (0, 0, 2, 2), (2, 0, 2, 2), (4, 0, 1, 2),
+        (0, 2, 2, 1), (2, 2, 2, 1), (4, 2, 1, 1)]
+
+    covered = np.zeros((3, 5), dtype=int)
+    for x_off, y_off, x_size, y_size in windows:
+        covered[y_off:y_off + y_size, x_off:x_off + x_size] += 1
+    assert np.all(covered == 1)
+
+    with pytest.raises(ValueError):
+        list(iter_windows(5, 3, 0))
+
+
+@pytest.mark.safe
+@pytest.mark.windowed
+def testWindowedSARWind_equals_SARWind(sarIW_SAFE, meps, fncDir):
+    """ Test that the windowed processing gives the same wind as the
+    full scene processing.
+    """
+    import netCDF4
+    from sarwind.sarwind import SARWind
+    from sarwind.windowed import WindowedSARWind
+
+    w = SARWind(sarIW_SAFE, meps)
+    fn = os.path.join(fncDir, 'windowed.nc')
+    ww = WindowedSARWind(sarIW_SAFE, meps, block_size=64)
+    ww.export(fn)
+    with netCDF4.Dataset(fn) as ds:
+        windspeed = ds['windspeed'][:].filled(np.nan)
+    assert windspeed.shape == w['windspeed'].shape
+    np.testing.assert_allclose(windspeed, w['windspeed'], rtol=1e-4, equal_nan=True)
+
+
+@pytest.mark.unittests
+@pytest.mark.windowed
+def testWindowedSARWind_export_bands(monkeypatch, fncDir):
+    """ Test that the bands to export can be selected by name, as in
+    Nansat.export.
+    """
+    import netCDF4
+    from sarwind.windowed import WindowedSARWind
+
+    with monkeypatch.context() as mp:
+        mp.setattr(WindowedSARWind, "__init__", lambda *a: None)
+        mp.setattr(WindowedSARWind, "shape", lambda self: (6, 8))
+        mp.setattr(WindowedSARWind, "_export_metadata", lambda self: {'title': 'SAR wind'})
+        w = WindowedSARWind()
+        w.mask = None
+        w.block_size = 4
+
+        fn = os.path.join(fncDir, 'windowed.nc')
+        w._writer(fn, bands=['windspeed', 'qc_flags']).close()
+        with netCDF4.Dataset(fn) as ds:
+            assert sorted(ds.variables) == ['latitude', 'longitude', 'qc_flags', 'windspeed']
+            assert ds['qc_flags'].flag_masks.dtype == np.uint8
+            assert ds.title == 'SAR wind'
+
+        with pytest.raises(ValueError):
+            w._writer(fn, bands=['valid'])
@@ -0,0 +1,136 @@
+import os
+import pytest
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+zarr = pytest.importorskip('zarr')
+
+from sarwind.qc import flag_masks  # noqa: E402
+from sarwind.qc import qc_band_parameters  # noqa: E402
+from sarwind.tiling import iter_windows  # noqa: E402
+from sarwind.zarr_export import create_store  # noqa: E402
+from sarwind.zarr_export import export_zarr  # noqa: E402
+from sarwind.zarr_export import write_block  # noqa: E402
+from sarwind.zarr_export import ZarrBlockWriter  # noqa: E402
+
+
+def _write(path, window, data):
+    x_off, y_off, x_size, y_size = window
+    write_block(path, window, {'windspeed': data[y_off:y_off + y_size, x_off:x_off + x_size]})
+
+
+@pytest.mark.unittests
+@pytest.mark.zarr
+def test_write_blocks_in_parallel(fncDir):
+    """ Test that chunk-aligned blocks written by parallel processes end
+    up in the store, with attributes.
+    """
+    path = os.path.join(fncDir, 'sarwind.zarr')
+    data = np.arange(70*50, dtype='f4').reshape(70, 50)
+    create_store(path, data.shape, 16, {
+        'windspeed': {'standard_name': 'wind_speed', 'units': 'm s-1'},
+        'valid': {'dtype': 'u1'}}, {'winddir_time': '2022-10-26T06:00:00'})
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(_write, path, window, data)
+                   for window in iter_windows(50, 70, 32)]
+        [future.result() for future in futures]
+
+    group = zarr.open_group(path, mode='r')
+    np.testing.assert_array_equal(group['windspeed'][:], data)
+    assert group['windspeed'].attrs['units'] == 'm s-1'
+    assert group['valid'].dtype == np.uint8
+    assert group.attrs['winddir_time'] == '2022-10-26T06:00:00'
+
+    with pytest.raises(ValueError):
+        write_block(path, (8, 0, 16, 16), {'windspeed': data[:16, 8:24]})
+
+
+class FakeProduct(object):
+    """ A Nansat-like SAR wind product with wind speed and QC flags.
+    """
+
+    def __init__(self):
+        self.arrays = {
+            1: np.arange(6*7, dtype='f4').reshape(6, 7),
+            2: np.full((6, 7), 3, dtype='u1'),
+        }
+        self.metadata = {
+            1: {'name': 'windspeed', 'standard_name': 'wind_speed', 'units': 'm s-1',
+                'dataType': '6', 'SourceFilename': '/vsimem/1.vrt'},
+            2: qc_band_parameters(),
+        }
+        self.lon, self.lat = np.meshgrid(np.arange(7.), np.arange(6.))
+
+    def bands(self):
+        return self.metadata
+
+    def get_metadata(self, band_id=None):
+        if band_id is None:
+            return {'history': '2022-10-26: sarwind.sarwind.SARWind(meps.nc, s1.SAFE)',
+                    'winddir_time': '2022-10-26T06:00:00'}
+        return self.metadata[band_id]
+
+    def __getitem__(self, band_id):
+        return self.arrays[band_id]
+
+    def get_geolocation_grids(self):
+        return self.lon, self.lat
+
+    def shape(self):
+        return (6, 7)
+
+
+@pytest.mark.unittests
+@pytest.mark.zarr
+def test_export_zarr(fncDir):
+    """ Test that bands, geolocation and metadata of a product are
+    exported, with numeric flag masks.
+    """
+    path = os.path.join(fncDir, 'product.zarr')
+    n = FakeProduct()
+    export_zarr(n, path, chunks=4, workers=2)
+
+    group = zarr.open_group(path, mode='r')
+    assert sorted(group.array_keys()) == ['latitude', 'longitude', 'qc_flags', 'windspeed']
+    np.testing.assert_array_equal(group['windspeed'][:], n.arrays[1])
+    np.testing.assert_array_equal(group['longitude'][:], n.lon)
+    assert group['windspeed'].attrs['units'] == 'm s-1'
+    assert 'SourceFilename' not in group['windspeed'].attrs
+    assert group['qc_flags'].dtype == np.uint8
+    assert group['qc_flags'].attrs['flag_masks'] == [1, 2, 4, 8]
+    assert all(isinstance(f, int) for f in group['qc_flags'].attrs['flag_masks'])
+    assert group.attrs['winddir_time'] == '2022-10-26T06:00:00'
+    assert group.attrs['history'].endswith('SARWind(meps.nc, s1.SAFE)')
+
+
+@pytest.mark.unittests
+@pytest.mark.zarr
+def testZarrBlockWriter(fncDir):
+    """ Test that blocks written with ZarrBlockWriter end up in the
+    store, with attributes.
+    """
+    path = os.path.join(fncDir, 'windowed.zarr')
+    attrs = qc_band_parameters()
+    attrs.pop('name')
+    attrs['flag_masks'] = flag_masks()
+    attrs['dtype'] = 'u1'
+    writer = ZarrBlockWriter(path, (5, 6), 4, {
+        'windspeed': {'units': 'm s-1', 'dtype': 'f4'},
+        'qc_flags': attrs}, {'winddir_time': '2022-10-26T06:00:00'})
+    data = np.arange(30, dtype='f4').reshape(5, 6)
+    for x_off, y_off, x_size, y_size in iter_windows(6, 5, 4):
+        writer.write((x_off, y_off, x_size, y_size), {
+            'windspeed': data[y_off:y_off + y_size, x_off:x_off + x_size],
+            'qc_flags': np.ones((y_size, x_size), dtype='u1'),
+            'not_in_store': np.zeros((y_size, x_size))})
+    writer.close()
+
+    group = zarr.open_group(path, mode='r')
+    np.testing.assert_array_equal(group['windspeed'][:], data)
+    np.testing.assert_array_equal(group['qc_flags'][:], 1)
+    assert group['windspeed'].chunks == (4, 4)
+    assert group['qc_flags'].attrs['flag_masks'] == [1, 2, 4, 8]
+    assert group.attrs['winddir_time'] == '2022-10-26T06:00:00'
@@ -0,0 +1,227 @@
+""" License: This file is part of https://github.com/metno/met-sar-vind
+             met-sar-vind is licensed under the Apache-2.0 license
+             (https://github.com/metno/met-sar-vind/blob/main/LICENSE).
+"""
+import os
+import pickle
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from scipy.spatial import cKDTree
+
+# Mean earth radius in metres
+EARTH_RADIUS = 6371000.
+
+# Bands extracted from SAR wind products
+BANDS = ['windspeed', 'winddirection', 'model_windspeed', 'valid']
+
+# In-memory cache of spatial indices, keyed by filename and modification time
+_index_cache = {}
+
+
+def lonlat2xyz(lon, lat):
+    """ Convert longitude and latitude [deg] to cartesian coordinates on
+    the unit sphere. Euclidean distances between these are monotonic in
+    great circle distance, so they can be used in a KD-tree without
+    problems at the poles or the antimeridian.
+    """
+    lon = np.radians(np.asarray(lon, dtype=float))
+    lat = np.radians(np.asarray(lat, dtype=float))
+    return np.stack((np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)), axis=-1)
+
+
+def chord2distance(chord):
+    """ Convert chord length on the unit sphere to great circle distance
+    in metres.
+    """
+    return 2*EARTH_RADIUS*np.arcsin(np.clip(chord/2, 0, 1))
+
+
+def distance2chord(distance):
+    """ Convert great circle distance in metres to chord length on the
+    unit sphere.
+    """
+    return 2*np.sin(np.minimum(distance/EARTH_RADIUS, np.pi)/2)
+
+
+class GeolocationIndex(object):
+    """
+    A spatial index (KD-tree) over the geolocation grids of a SAR wind
+    product.
+
+    Parameters
+    -----------
+    lon : numpy.array
+                2D array with longitudes
+    lat : numpy.array
+                2D array with latitudes
+    """
+
+    def __init__(self, lon, lat):
+        self.shape = np.shape(lon)
+        xyz = lonlat2xyz(lon, lat).reshape(-1, 3)
+        self.finite = np.all(np.isfinite(xyz), axis=1)
+        self.tree = cKDTree(xyz[self.finite])
+        self.pixels = np.flatnonzero(self.finite)
+
+    def query(self, lon, lat, max_distance=np.inf):
+        """ Find the nearest pixels to the given points.
+
+        Returns
+        --------
+        rows, cols : numpy.array
+                Pixel indices of the nearest pixels (-1 if no pixel is
+                closer than max_distance)
+        distance : numpy.array
+                Distance in metres to the nearest pixels
+        """
+        xyz = lonlat2xyz(lon, lat).reshape(-1, 3)
+        chord, ind = self.tree.query(xyz, distance_upper_bound=distance2chord(max_distance))
+        found = ind < self.tree.n
+        rows = np.full(ind.shape, -1)
+        cols = np.full(ind.shape, -1)
+        rows[found], cols[found] = np.unravel_index(self.pixels[ind[found]], self.shape)
+        distance = np.full(ind.shape, np.nan)
+        distance[found] = chord2distance(chord[found])
+        return rows, cols, distance
+
+
+def _open_product(filename):
+    """ Open a SAR wind product with Nansat.
+    """
+    from nansat.nansat import Nansat
+    return Nansat(filename)
+
+
+def get_index(filename, n=None, cache_dir=None):
+    """ Return the GeolocationIndex of a SAR wind product.
+
+    The index is cached in memory, and as a pickle file in cache_dir if
+    given. The pickle files are named by a hash of the absolute path of
+    the product. Cached indices are rebuilt if the product has been
+    modified, or if their shape does not match the product.
+    """
+    filename = os.path.abspath(filename)
+    mtime = os.path.getmtime(filename)
+    key = (filename, mtime)
+    if key in _index_cache:
+        return _index_cache[key]
+
+    if n is None:
+        n = _open_product(filename)
+
+    index = None
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, '%s_%s.kdtree.pkl' % (
+            os.path.basename(filename), hashlib.sha1(filename.encode()).hexdigest()))
+        if os.path.isfile(cache_file) and os.path.getmtime(cache_file) >= mtime:
+            with open(cache_file, 'rb') as fid:
+                index = pickle.load(fid)
+            if index.shape != n.shape():
+                index = None
+
+    if index is None:
+        index = GeolocationIndex(*n.get_geolocation_grids())
+        if cache_file is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_file, 'wb') as fid:
+                pickle.dump(index, fid, protocol=pickle.HIGHEST_PROTOCOL)
+    _index_cache[key] = index
+    return index
+
+
+def _extract_from_product(filename, points, time_window, max_distance, cache_dir):
+    """ Extract SAR wind at the points within the time window of the
+    product time. Returns a list with a pandas.DataFrame of the matched
+    points, or an empty list.
+    """
+    n = _open_product(filename)
+    product_time = np.datetime64(n.time_coverage_start.replace(tzinfo=None), 'ns')
+    in_time = np.abs(points['time'] - product_time) <= time_window
+    if not np.any(in_time):
+        return []
+
+    index = get_index(filename, n=n, cache_dir=cache_dir)
+    rows, cols, distance = index.query(
+        points['lon'][in_time], points['lat'][in_time], max_distance=max_distance)
+    found = rows >= 0
+    if not np.any(found):
+        return []
+    rows, cols, distance = rows[found], cols[found], distance[found]
+
+    result = {
+        'product': os.path.basename(filename),
+        'product_time': product_time,
+        'row': rows,
+        'col': cols,
+        'distance': distance,
+    }
+    for key in points:
+        result[key] = points[key][in_time][found]
+    for band in BANDS:
+        if n.has_band(band):
+            result[band] = n[band][rows, cols]
+        else:
+            result[band] = np.full(rows.shape, np.nan)
+    result['valid'] = result['valid'] == 1
+    return [pd.DataFrame(result)]
+
+
+def extract_points(products, points, time_window=timedelta(hours=1), max_distance=1000.,
+                   workers=None, cache_dir=None):
+    """ Extract SAR wind at points (e.g., buoys or stations) from many SAR
+    wind products in parallel threads (reading with GDAL and querying the
+    KD-trees release the GIL, and the threads share the in-memory cache
+    of spatial indices).
+
+    Parameters
+    -----------
+    products : list
+                Filenames of SAR wind products
+    points : pandas.DataFrame or dict
+                Points with (at least) the columns 'lon', 'lat' and 'time'.
+                Additional columns (e.g., station id or observed wind) are
+                copied to the output.
+    time_window : datetime.timedelta
+                Maximum time difference between points and products
+    max_distance : float
+                Maximum distance in metres to the nearest SAR pixel
+    workers : int
+                Number of worker threads (default: depends on the number
+                of CPUs). Products are processed serially if workers is 1.
+    cache_dir : string
+                Directory for caching the spatial indices on disk
+
+    Returns
+    --------
+    pandas.DataFrame with one row per collocated point and product, with
+    columns product, product_time, row, col, distance, the input columns
+    and windspeed, winddirection, model_windspeed and valid.
+    """
+    points = pd.DataFrame(points)
+    for key in ['lon', 'lat', 'time']:
+        if key not in points:
+            raise KeyError('points must have the column %s' % key)
+    points = {key: points[key].to_numpy() for key in points}
+    points['time'] = points['time'].astype('datetime64[ns]')
+    time_window = np.timedelta64(time_window)
+
+    args = (points, time_window, max_distance, cache_dir)
+    if workers == 1:
+        tables = [_extract_from_product(fn, *args) for fn in products]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_from_product, fn, *args) for fn in products]
+            tables = [future.result() for future in futures]
+
+    tables = [table for product_tables in tables for table in product_tables]
+    if not tables:
+        columns = ['product', 'product_time', 'row', 'col', 'distance']
+        return pd.DataFrame(columns=columns + list(points.keys()) + BANDS)
+    return pd.concat(tables, ignore_index=True)